@@ -0,0 +1,234 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+"""
+Benchmark suite: pack/unpack throughput, compression ratio and peak memory over a fixed corpus,
+against pickle (protocol 5) + lz4 as a baseline.
+
+    python benchmarks/suite.py run -o before.json
+    python benchmarks/suite.py run -o after.json --sizes small,medium --cases 'frame*'
+    python benchmarks/suite.py compare before.json after.json --threshold 0.15
+
+Throughput is given over the size of the plain pickle of each payload, the same yardstick for every codec.
+Timings are the best of several repetitions, each one running for at least '--min-time' seconds.
+'compare' exits with status 1 when some metric got worse by more than '--threshold' (relative).
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import pickle
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from decimal import Decimal
+from timeit import Timer
+
+import lz4.frame as lz4
+
+from safeserializer import pack, unpack
+
+SIZES = {"small": 10, "medium": 1_000, "large": 100_000}
+SEED = 0
+
+
+class Point:
+    """Arbitrary class, only serializable through the pickle fallback."""
+
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+def corpus(n):
+    """Payloads with about 'n' items each, as (name, obj, unsafe_fallback)."""
+    import numpy as np
+    import pandas as pd
+
+    rnd = np.random.default_rng(SEED)
+    words = np.array([f"w{i}" for i in range(max(n // 10, 1))], dtype=object)
+    records = [{"id": i, "name": f"user{i}", "tags": ["a", "b"], "score": i / 3, "active": i % 2 == 0} for i in range(n)]
+    yield "json", records, False
+    yield "bson", {str(i): {"a": [1, 2, 3], "b": b"x"} for i in range(n)}, False
+    yield "mixed", {("row", i): {"raw": bytes(rnd.integers(0, 256, 64, dtype=np.uint8)), "id": i} for i in range(n)}, False
+    yield "bigint", [2**100 + i for i in range(n)], False
+    for dtype in ["float64", "int32", "uint8", "bool"]:
+        yield f"ndarray-{dtype}", (rnd.random(n * 100) * 100).astype(dtype), False
+    yield "ndarray-2d", rnd.random((n, 100)), False
+    yield "frame-numeric", pd.DataFrame({"a": rnd.integers(0, 1000, n), "b": rnd.random(n), "c": rnd.random(n) > 0.5}), False
+    yield "frame-str", pd.DataFrame({"word": rnd.choice(words, n), "value": rnd.random(n)}), False
+    yield "series-numeric", pd.Series(rnd.random(n), name="x"), False
+    yield "series-str", pd.Series(rnd.choice(words, n)), False
+    yield "pickle-fallback", [Point(i, Decimal(i) / 7) for i in range(n)], True
+
+
+def safeserializer_codec(obj, unsafe_fallback):
+    return lambda: pack(obj, ensure_determinism=True, unsafe_fallback=unsafe_fallback), unpack
+
+
+def pickle_codec(obj, unsafe_fallback):
+    return lambda: lz4.compress(pickle.dumps(obj, protocol=5)), lambda blob: pickle.loads(lz4.decompress(blob))
+
+
+CODECS = {"safeserializer": safeserializer_codec, "pickle+lz4": pickle_codec}
+
+
+def best_time(fun, min_time, repeat):
+    """Best time per call among 'repeat' rounds, each one long enough to last 'min_time' seconds."""
+    timer = Timer(fun)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(fun):
+    """Peak of memory allocated by a single call, as traced by 'tracemalloc' (numpy allocations included)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fun()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, size, obj, unsafe_fallback, codec, min_time, repeat):
+    encode, decode = CODECS[codec](obj, unsafe_fallback)
+    blob = encode()
+    payload = len(pickle.dumps(obj, protocol=5))
+    pack_s = best_time(encode, min_time, repeat)
+    unpack_s = best_time(lambda: decode(blob), min_time, repeat)
+    return {
+        "case": name,
+        "size": size,
+        "codec": codec,
+        "payload_bytes": payload,
+        "blob_bytes": len(blob),
+        "ratio": payload / len(blob),
+        "pack_s": pack_s,
+        "unpack_s": unpack_s,
+        "pack_ops": 1 / pack_s,
+        "unpack_ops": 1 / unpack_s,
+        "pack_MBps": payload / pack_s / 1e6,
+        "unpack_MBps": payload / unpack_s / 1e6,
+        "pack_peak": peak_memory(encode),
+        "unpack_peak": peak_memory(lambda: decode(blob)),
+    }
+
+
+def environment():
+    import lz4 as lz4_package
+    import numpy
+    import pandas
+
+    import safeserializer
+
+    versions = {m.__name__: getattr(m, "__version__", "?") for m in [numpy, pandas, lz4_package, safeserializer]}
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "versions": versions,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def run(args):
+    results = []
+    for size in args.sizes.split(","):
+        for name, obj, unsafe_fallback in corpus(SIZES[size]):
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in args.cases.split(",")):
+                continue
+            for codec in CODECS:
+                r = measure(name, size, obj, unsafe_fallback, codec, args.min_time, args.repeat)
+                results.append(r)
+                print(
+                    f"{name:16} {size:7} {codec:15} pack {r['pack_MBps']:9.1f} MB/s {r['pack_ops']:10.0f} op/s  "
+                    f"unpack {r['unpack_MBps']:9.1f} MB/s {r['unpack_ops']:10.0f} op/s  "
+                    f"ratio {r['ratio']:6.2f}  peak {r['pack_peak'] / 1e6:8.2f} / {r['unpack_peak'] / 1e6:8.2f} MB",
+                    flush=True,
+                )
+    report = {"environment": environment(), "min_time": args.min_time, "repeat": args.repeat, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Written to {args.output}.")
+
+
+# Metric -> True when higher is better.
+METRICS = {"pack_s": False, "unpack_s": False, "ratio": True, "pack_peak": False, "unpack_peak": False}
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    key = lambda r: (r["case"], r["size"], r["codec"])  # noqa: E731
+    old = {key(r): r for r in base["results"]}
+    regressions = 0
+    for r in new["results"]:
+        if key(r) not in old or (args.codec and r["codec"] != args.codec):
+            continue
+        changes = []
+        for metric, higher_is_better in METRICS.items():
+            a, b = old[key(r)][metric], r[metric]
+            change = (b - a) / a if a else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > args.threshold:
+                flag, regressions = "!", regressions + 1
+            changes.append(f"{metric} {change:+7.1%}{flag:1}")
+        print(f"{r['case']:16} {r['size']:7} {r['codec']:15} " + "  ".join(changes))
+    missing = set(old) - {key(r) for r in new["results"]}
+    if missing:
+        print(f"{len(missing)} cases only in {args.base}.")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}.")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="run the corpus and optionally write the results as JSON")
+    p.add_argument("-o", "--output", help="JSON file to write")
+    p.add_argument("--sizes", default="small,medium,large", help=f"comma-separated subset of {', '.join(SIZES)}")
+    p.add_argument("--cases", default="*", help="comma-separated glob patterns on case names")
+    p.add_argument("--min-time", type=float, default=0.2, help="minimum duration of each timing round, in seconds")
+    p.add_argument("--repeat", type=int, default=5, help="number of timing rounds, the best one is kept")
+    p = sub.add_parser("compare", help="flag regressions between two JSON results")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.1, help="relative worsening to flag, e.g., 0.1 for 10%%")
+    p.add_argument("--codec", default="safeserializer", help="only compare this codec (empty for all)")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == "__main__":
+    t = time.perf_counter()
+    status = main()
+    print(f"{time.perf_counter() - t:.1f}s", file=sys.stderr)
+    sys.exit(status)
@@ -8,7 +8,7 @@ from pandas import DataFrame as DF
 from pandas import Series as S
 from pyarrow.feather import read_feather, write_feather
 
-from safeserializer.compression import pack, unpack
+from safeserializer import pack, pack_many, unpack, unpack_many
 
 print("All options, except 'deprecated' and 'pickle' are unable to handle np.object (e.g., DF containing strings).")
 print("Both options are unsafe (deprecated seems to use pickle).")
@@ -81,3 +81,53 @@ for l in [5, 1000]:
     # print("feather", round(t , 3), "ms", sep="\t\t")
     t = timeit(d, number=1000)
     print(f"parquet\t{round(t * 10, 3):2.3} ms", d(), sep="\t\t")
+
+print()
+print("DataFrames alone, pack+unpack (safeserializer stores them column by column; pickle and parquet compressed by lz4).")
+for l in [5, 1000]:
+    for name, df in [("df1", DF({"a": [5, 9, 11] * l, "b": [7, 13, 19] * l})),
+                     ("df2", DF({"a": ['5', '9', '11'] * l, "b": [7, 13, 19] * l}))]:
+        def g():
+            a = pack(df, ensure_determinism=True, unsafe_fallback=False)
+            unpack(a)
+            return len(a)
+
+        def h():
+            a = compress(dumps(df, protocol=5))
+            loads(decompress(a))
+            return len(a)
+
+        def i():
+            buf = pa.BufferOutputStream()
+            pq.write_table(pa.Table.from_pandas(df), buf, compression='lz4', compression_level=0)
+            a = bytes(buf.getvalue())
+            pq.read_table(pa.BufferReader(a)).to_pandas()
+            return len(a)
+
+        print(f"{name} x{l}", end="\t")
+        for label, fun in [("pack", g), ("pickle", h), ("parquet", i)]:
+            t = timeit(fun, number=1000)
+            print(f"{label}\t{round(t, 3):2.3} ms", fun(), sep="\t", end="\t\t")
+        print()
+
+print()
+print("Batch packing/unpacking of the same payloads, in input order.")
+objs = [s, df1, df2] * 1000
+
+
+def e():
+    return sum(len(a) for a in [pack(o, ensure_determinism=True, unsafe_fallback=False) for o in objs])
+
+
+def f(executor):
+    blobs = list(pack_many(objs, ensure_determinism=True, unsafe_fallback=False, executor=executor, chunksize=50))
+    list(unpack_many(blobs, executor=executor, chunksize=50))
+    return sum(len(a) for a in blobs)
+
+
+t = timeit(lambda: [unpack(a) for a in [pack(o, ensure_determinism=True, unsafe_fallback=False) for o in objs]], number=3)
+print(f"loop\t{round(t / 3, 3):2.3} s", e(), sep="\t", end="\t\t")
+for executor in ["thread", "process"]:
+    t = timeit(lambda: f(executor), number=3)
+    print(f"{executor}\t{round(t / 3, 3):2.3} s", f(executor), sep="\t", end="\t\t")
+print()
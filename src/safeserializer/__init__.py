@@ -1 +1,11 @@
-from safeserializer.compression import pack, unpack
+from safeserializer.compression import pack, register_type, unpack, unpack_records, unregister_type
+from safeserializer.stream import pack_into, pack_to, packed_size, unpack_from
+from safeserializer.lazy import lazy_unpack
+from safeserializer.batch import pack_many, unpack_many
+from safeserializer.cache import PackCache
+from safeserializer.compressors import Adaptive, BlockReader, Blocks, Codec, register_codec
+from safeserializer.instrument import Stats, collect
+from safeserializer.fingerprint import digest
+from safeserializer.delta import apply_delta, pack_delta
+from safeserializer.shared import SharedHandle, pack_shared, unpack_shared
+from safeserializer.aio import apack, aunpack, pack_to_stream, unpack_from_stream
@@ -0,0 +1,140 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+"""
+Coroutines for asyncio services: small objects are packed inline, large ones on an executor, so the event loop is not blocked.
+"""
+import asyncio
+import sys
+from functools import partial
+
+from safeserializer.compression import pack, unpack
+from safeserializer.stream import CHUNKSIZE
+
+THRESHOLD = 1 << 16
+
+
+async def apack(obj, ensure_determinism, unsafe_fallback, compressed=True, buffer_callback=None, indexed=False, dedup=False,
+                cache=None, version=1, executor=None, threshold=THRESHOLD):
+    """
+    Coroutine version of 'pack()', with the same arguments and result.
+
+    Objects estimated under 'threshold' bytes are packed inline; larger ones run on 'executor'
+    (the loop default executor when None), so that traversal and compression do not block the event loop.
+    The estimate comes from array sizes, bytes/str lengths and item counts, and stops as soon as 'threshold' is crossed.
+
+    >>> import numpy as np
+    >>> obj = {"a": np.arange(100_000), "b": [1, 2]}
+    >>> blob = asyncio.run(apack(obj, ensure_determinism=True, unsafe_fallback=False))
+    >>> blob == pack(obj, ensure_determinism=True, unsafe_fallback=False)
+    True
+    >>> asyncio.run(aunpack(blob))["a"][-1]
+    99999
+    """
+    call = partial(pack, obj, ensure_determinism, unsafe_fallback, compressed, buffer_callback, indexed, dedup, cache, version)
+    if _estimate(obj, threshold) <= threshold:
+        return call()
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def aunpack(blob, buffers=None, executor=None, threshold=THRESHOLD):
+    """Coroutine version of 'unpack()': blobs larger than 'threshold' bytes are unpacked on 'executor', as in 'apack()'."""
+    if len(blob) <= threshold:
+        return unpack(blob, buffers)
+    return await asyncio.get_running_loop().run_in_executor(executor, unpack, blob, buffers)
+
+
+async def pack_to_stream(writer, obj, ensure_determinism, unsafe_fallback, compressed=True, version=1, executor=None,
+                         threshold=THRESHOLD, chunksize=CHUNKSIZE):
+    """
+    Pack 'obj' (as 'apack()') and write it to the 'asyncio.StreamWriter', as one message preceded by its length
+    (uint64, little endian).
+
+    The blob is written at most 'chunksize' bytes at a time, waiting on 'writer.drain()' in between,
+    so that a slow peer holds back the sender instead of filling the transport buffer.
+    Return the number of bytes written, length prefix included.
+
+    >>> import socket
+    >>> async def main():
+    ...     a, b = socket.socketpair()
+    ...     reader, a_writer = await asyncio.open_connection(sock=a)
+    ...     b_reader, writer = await asyncio.open_connection(sock=b)
+    ...     await pack_to_stream(writer, [1, b"x"], ensure_determinism=True, unsafe_fallback=False)
+    ...     await pack_to_stream(writer, (3, 4), ensure_determinism=True, unsafe_fallback=False, chunksize=5)
+    ...     writer.close()
+    ...     objs = [await unpack_from_stream(reader), await unpack_from_stream(reader)]
+    ...     try:
+    ...         await unpack_from_stream(reader)
+    ...     except EOFError as e:
+    ...         objs.append(str(e))
+    ...     a_writer.close()
+    ...     return objs
+    >>> asyncio.run(main())
+    [[1, b'x'], (3, 4), 'End of stream.']
+    """
+    blob = await apack(obj, ensure_determinism, unsafe_fallback, compressed, version=version, executor=executor,
+                       threshold=threshold)
+    writer.write(len(blob).to_bytes(8, byteorder="little"))
+    view = memoryview(blob)
+    for i in range(0, len(view), chunksize):
+        writer.write(view[i : i + chunksize])
+        await writer.drain()
+    return 8 + len(blob)
+
+
+async def unpack_from_stream(reader, executor=None, threshold=THRESHOLD):
+    """
+    Read and unpack (as 'aunpack()') the next message written by 'pack_to_stream()' from the 'asyncio.StreamReader'.
+
+    Raise 'EOFError' when the stream ends before a message or in the middle of one.
+    """
+    try:
+        size = int.from_bytes(await reader.readexactly(8), byteorder="little")
+        blob = await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            raise EOFError("End of stream.") from None
+        raise EOFError(f"Truncated message ({len(e.partial)} of {e.expected} bytes).") from None
+    return await aunpack(blob, executor=executor, threshold=threshold)
+
+
+def _estimate(obj, limit):
+    """Rough size of 'obj' in bytes, not counted further once above 'limit'."""
+    total, stack = 0, [obj]
+    while stack and total <= limit:
+        o = stack.pop()
+        typ = type(o)
+        if typ in (str, bytes, bytearray):
+            total += len(o)
+        elif typ is list or typ is tuple:
+            total += 8 * len(o)
+            stack.extend(o)
+        elif typ is dict:
+            total += 16 * len(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif hasattr(o, "memory_usage") and hasattr(o, "columns"):  # DataFrame
+            total += int(o.memory_usage(index=True).sum())
+        elif hasattr(o, "nbytes") and typ.__module__.split(".")[0] in ("numpy", "pandas"):
+            total += o.nbytes
+        else:
+            total += sys.getsizeof(o)
+    return total
@@ -0,0 +1,125 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from safeserializer.compression import _decode, pack, traversal_enc, unpack
+from safeserializer.compressors import compress, decompress
+
+
+def pack_many(objs, ensure_determinism, unsafe_fallback, compressed=True, executor=None, chunksize=1, version=1):
+    """
+    Serialize each object from the iterable 'objs', yielding blobs identical to 'pack()' in input order.
+
+    'executor' can be:
+        None or "thread": traversal runs in the calling thread while compression
+            (lz4, zlib and lzma release the GIL) runs on a thread pool;
+        "process": whole 'pack()' calls, including the pure-Python traversal, run on a process pool;
+        an 'Executor' instance, used as in the matching option above (not shut down here).
+    'chunksize' items are sent together to each task.
+    'version' selects the format, as in 'pack()'.
+    Only a bounded number of tasks is in flight, so 'objs' can be an endless generator.
+
+    >>> import numpy as np
+    >>> objs = [{"i": i, "a": np.arange(i)} for i in range(4)]
+    >>> blobs = list(pack_many(objs, ensure_determinism=True, unsafe_fallback=False))
+    >>> blobs == [pack(o, ensure_determinism=True, unsafe_fallback=False) for o in objs]
+    True
+    >>> list(unpack_many(blobs, chunksize=3))[3]
+    {'i': 3, 'a': array([0, 1, 2])}
+    """
+    if not compressed and executor is None:
+        for obj in objs:
+            yield traversal_enc(obj, ensure_determinism, unsafe_fallback, version=version)
+        return
+    executor, owned = _executor(executor)
+    try:
+        if isinstance(executor, ProcessPoolExecutor):
+            args = ensure_determinism, unsafe_fallback, compressed, version
+            yield from _ordered(executor, _pack_chunk, objs, chunksize, *args)
+        else:
+            dumps = (traversal_enc(obj, ensure_determinism, unsafe_fallback, version=version) for obj in objs)
+            if compressed:
+                yield from _ordered(executor, _compress_chunk, dumps, chunksize, compressed)
+            else:
+                yield from dumps
+    finally:
+        if owned:
+            executor.shutdown(cancel_futures=True)
+
+
+def unpack_many(blobs, executor=None, chunksize=1):
+    """
+    Deserialize each blob from the iterable 'blobs', yielding objects in input order.
+
+    'executor' is interpreted as in 'pack_many()': with threads, only decompression is parallel.
+    """
+    executor, owned = _executor(executor)
+    try:
+        if isinstance(executor, ProcessPoolExecutor):
+            yield from _ordered(executor, _unpack_chunk, blobs, chunksize)
+        else:
+            for dump in _ordered(executor, _decompress_chunk, blobs, chunksize):
+                yield _decode(dump)
+    finally:
+        if owned:
+            executor.shutdown(cancel_futures=True)
+
+
+def _executor(executor):
+    if isinstance(executor, Executor):
+        return executor, False
+    if executor is None or executor == "thread":
+        return ThreadPoolExecutor(), True
+    if executor == "process":
+        return ProcessPoolExecutor(), True
+    raise Exception(f"Unknown executor: {executor}")
+
+
+def _ordered(executor, fn, items, chunksize, *args):
+    """Apply 'fn' to chunks of 'items' on 'executor', keeping a few tasks per worker in flight."""
+    window = 2 * (getattr(executor, "_max_workers", None) or os.cpu_count() or 1)
+    items, pending = iter(items), deque()
+    while True:
+        while len(pending) < window and (chunk := list(islice(items, chunksize))):
+            pending.append(executor.submit(fn, chunk, *args))
+        if not pending:
+            return
+        yield from pending.popleft().result()
+
+
+def _compress_chunk(dumps, compressed):
+    return [compress(dump, compressed) for dump in dumps]
+
+
+def _decompress_chunk(blobs):
+    return [decompress(blob) for blob in blobs]
+
+
+def _pack_chunk(objs, ensure_determinism, unsafe_fallback, compressed, version):
+    return [pack(obj, ensure_determinism, unsafe_fallback, compressed, version=version) for obj in objs]
+
+
+def _unpack_chunk(blobs):
+    return [unpack(blob) for blob in blobs]
@@ -0,0 +1,163 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+import weakref
+from collections import OrderedDict
+from threading import RLock
+
+
+class PackCache:
+    """
+    LRU cache of the encoded blobs of ndarrays, Series and DataFrames, for objects packed again and again.
+
+    Entries are keyed by object identity and hold the object only through a weak reference:
+    they are dropped when the object is garbage collected.
+    An object is assumed unchanged while it is alive. For mutable objects, 'token(obj)' is added to the key,
+    e.g., a version number kept by the caller; a new token misses and replaces the stale entry.
+    The blobs are kept within 'max_bytes'; least recently used ones are evicted first.
+    They are stored as bytes: chunked blobs (e.g., from 'pack_to()'), which view the memory of the object, are joined first.
+    Packing with a 'buffer_callback' does not use the cache.
+    Safe to share among threads.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack, unpack
+    >>> weights = np.arange(1000.)
+    >>> cache = PackCache(max_bytes=20000)
+    >>> blobs = [pack({"id": i, "w": weights}, ensure_determinism=True, unsafe_fallback=False, cache=cache) for i in range(3)]
+    >>> unpack(blobs[2])["w"][-1], cache.stats()
+    (999.0, {'hits': 2, 'misses': 1, 'evictions': 0, 'entries': 1, 'nbytes': 8027})
+    >>> big = np.arange(2000.)
+    >>> _ = pack([big, weights], ensure_determinism=True, unsafe_fallback=False, cache=cache)
+    >>> cache.stats()
+    {'hits': 2, 'misses': 3, 'evictions': 2, 'entries': 1, 'nbytes': 8027}
+    >>> del weights
+    >>> cache.stats()
+    {'hits': 2, 'misses': 3, 'evictions': 2, 'entries': 0, 'nbytes': 0}
+
+    Versioned mutable objects.
+    >>> import pandas as pd
+    >>> df = pd.DataFrame({"a": [1, 2]})
+    >>> df.attrs["version"] = 1
+    >>> cache = PackCache(token=lambda obj: obj.attrs.get("version"))
+    >>> _ = pack(df, ensure_determinism=True, unsafe_fallback=False, cache=cache)
+    >>> df.loc[0, "a"], df.attrs["version"] = 5, 2
+    >>> unpack(pack(df, ensure_determinism=True, unsafe_fallback=False, cache=cache))["a"].tolist()
+    [5, 2]
+    >>> cache.stats()["misses"], len(cache)
+    (2, 1)
+
+    Chunked output does not keep the object alive.
+    >>> from io import BytesIO
+    >>> from safeserializer import pack_to
+    >>> a = np.arange(1000.)
+    >>> cache = PackCache()
+    >>> _ = pack_to(BytesIO(), a, ensure_determinism=True, unsafe_fallback=False, cache=cache)
+    >>> len(cache)
+    1
+    >>> del a
+    >>> len(cache)
+    0
+    """
+
+    def __init__(self, max_bytes=1 << 28, token=None):
+        self.max_bytes = max_bytes
+        self.token = token
+        self.hits = self.misses = self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()  # (id, options) -> (token, blob)
+        self._refs = {}  # id -> (weakref, set of keys)
+        self._lock = RLock()  # Reentrant: weakref callbacks may run during a garbage collection triggered under the lock.
+
+    def get(self, obj, options):
+        """Blob cached for 'obj' packed with the (hashable) 'options', or None."""
+        key = id(obj), options
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.token is None or entry[0] == self.token(obj)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+    def put(self, obj, options, blob):
+        size = len(blob) if type(blob) is bytes else blob.nbytes
+        if size > self.max_bytes:
+            return
+        if type(blob) is not bytes:  # Chunks would borrow the memory of 'obj', keeping it alive.
+            blob = b"".join(blob.leaves())
+        key, i = (id(obj), options), id(obj)
+        token = None if self.token is None else self.token(obj)
+        with self._lock:
+            self._pop(key)
+            if i not in self._refs:
+                try:
+                    self._refs[i] = weakref.ref(obj, lambda _, i=i: self._expire(i)), set()
+                except TypeError:  # pragma: no cover
+                    return
+            self._entries[key] = token, blob
+            self._refs[i][1].add(key)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, obj):
+        """Forget every blob of 'obj', e.g., after changing it in place without a 'token'."""
+        self._expire(id(obj))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._refs.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "nbytes": self.nbytes,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"PackCache({self.stats()})"
+
+    def _expire(self, i):
+        with self._lock:
+            _, keys = self._refs.pop(i, (None, ()))
+            for key in list(keys):
+                self._pop(key)
+
+    def _pop(self, key):
+        """Remove an entry, if present. The lock should be held."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            blob = entry[1]
+            self.nbytes -= len(blob) if type(blob) is bytes else blob.nbytes
+            refs = self._refs.get(key[0])
+            if refs is not None:
+                refs[1].discard(key)
+                if not refs[1]:
+                    del self._refs[key[0]]
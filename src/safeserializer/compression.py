@@ -20,12 +20,24 @@
 #  part of this work is illegal and unethical regarding the effort and
 #  time spent here.
 import pickle
-from binascii import hexlify, unhexlify
+import re
+import struct
+from binascii import unhexlify
+from collections.abc import Mapping
+from dataclasses import fields, is_dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from operator import itemgetter
+from time import perf_counter
+from uuid import UUID
 
 import bson
 from bson import InvalidDocument
 from orjson import orjson
 
+from safeserializer import instrument
+from safeserializer.compressors import compress, decompress
+
 
 def topickle(obj, ensure_determinism):
     """
@@ -76,7 +88,8 @@ def frompickle(blob):
         return dill.loads(blob)
 
 
-def traversal_enc(obj, ensure_determinism, unsafe_fallback):
+def traversal_enc(obj, ensure_determinism, unsafe_fallback, buffer_callback=None, indexed=False, dedup=False, cache=None,
+                  version=1, canonical=False, records=False):
     """
     TODO: Fix nested tuples being converted to lists by json?
         'tuple' should make orjson/bson raise an exception like it would happen for hditc,
@@ -110,7 +123,7 @@ def traversal_enc(obj, ensure_determinism, unsafe_fallback):
     >>> s = S({"a": "5", "b": "6"})
     >>> b = pack(s, ensure_determinism=True, unsafe_fallback=False)
     >>> b
-    b'00lz4__\\x04"M\\x18h@\\x1d\\x08\\x00\\x00\\x00\\x00\\x00\\x00\\xec\\xe2\\x04\\x00\\x00\\xf0\\x1100prqs_PAR1\\x15\\x04\\x15\\x14\\x15\\x18L\\x15\\x04\\x15\\x00\\x12\\x00\\x00\\n$\\x01\\x00\\x00\\x005\\x05\\x00\\xf696\\x15\\x00\\x15\\x12\\x15\\x16,\\x15\\x04\\x15\\x10\\x15\\x06\\x15\\x06\\x1c6\\x00(\\x016\\x18\\x015\\x00\\x00\\x00\\t \\x02\\x00\\x00\\x00\\x04\\x01\\x01\\x03\\x02&\\x88\\x01\\x1c\\x15\\x0c\\x195\\x10\\x00\\x06\\x19\\x18\\x06_none_\\x15\\x02\\x16\\x04\\x16x\\x16\\x80\\x01&<&\\x088\\x00\\x10\\x19L\\x00\\x90\\x00\\x15\\x02\\x00\\x15\\x00\\x15\\x10\\x15B\\x00\\x0f}\\x00\\x01\\x10a}\\x00\\x1fb}\\x00\\x01Kb\\x18\\x01a}\\x00&\\x82\\x03}\\x00\\xf7\\x02\\x11__index_level_0_\\x88\\x00Q\\xb6\\x02&\\x82\\x02\\x8a\\x00\\x01E\\x00\\x0f\\x8a\\x00\\x01\\xf4\\x04\\x19<5\\x00\\x18\\x06schema\\x15\\x04\\x00\\x15\\x0c%\\x02\\xd0\\x00b%\\x00L\\x1c\\x00\\x00\\x13\\x00\\x0ef\\x00\\x03\\x1e\\x00o\\x16\\x04\\x19\\x1c\\x19,\\x0f\\x01*\\x0f\\xcf\\x007\\xf2\\r\\x16\\xf0\\x01\\x16\\x04&\\x08\\x16\\x80\\x02\\x14\\x00\\x00\\x19,\\x18\\x06pandas\\x18\\xfc\\x03{"%\\x01\\xcdcolumns": ["9\\x01R"], ""\\x00\\x02T\\x01\\x11e)\\x00\\xfa\\x07{"name": null, "field_\\x14\\x00\\x02i\\x00@_typ)\\x00\\xf5\\x02"unicode", "numpy\\x19\\x00`object\\x18\\x00\\xf6\\x12metadata": {"encoding": "UTF-8"}}\\x8d\\x00\\n\\x86\\x00\\x12"n\\x02\\x00D\\x00\\t\\x8a\\x00\\x07\\x18\\x00\\x0f\\x8e\\x00*\\x00\\xe6\\x00?}, \\xf6\\x00\\n\\x0f<\\x01\\x00\\x0fw\\x002\\x01\\xf4\\x00areator\\x18\\x01plibrary\\x17\\x01ppyarrow\\xf7\\x00pversion\\x16\\x00\\x8611.0.0"}~\\x00\\x08\\x1d\\x00\\xf2\\x00.5.3"}\\x00\\x18\\x0cARROW:\\xe6\\x02@\\x18\\xe0\\x07/\\x01\\x00\\x82+ACAAAQA\\x01\\x00\\xf1\\x00KAA4ABgAFAAgACg\\x15\\x00)BB \\x00\\x10w\\x15\\x00\\x15E \\x00 DQ@\\x00\\x10E\\x15\\x00\\x02F\\x00\\x01 \\x00\\x10I\\x08\\x00\\x11B\\x08\\x00\\x01E\\x00\\x10I \\x00\\x02%\\x00\\xf4FYAAABwYW5kYXMAAPwBAAB7ImluZGV4X2NvbHVtbnMiOiBbIl9faW5kZXhfbGV2ZWxfMF9fIl0sICJjb2x1bW5$\\x00\\xf0\\x01lcyI6IFt7Im5hbWUD\\x00\\xf3\\x15udWxsLCAiZmllbGRfbmFtZSI6IG51bGwsICJ\\x90\\x00aNfdHlw\\x1c\\x00\\xf0\\x0eCJ1bmljb2RlIiwgIm51bXB5X3R5cGX\\x00\\xa2Aib2JqZWN0 \\x00\\xf0\\x0c1ldGFkYXRhIjogeyJlbmNvZGluZ\\x94\\x00\\xd9CJVVEYtOCJ9fV\\xbc\\x00\\x10z0\\x00EW3si\\x98\\x00\\xbfCJfbm9uZV8i\\xb8\\x00\\x02\\x0b \\x00\\x88cGFuZGFz\\x9c\\x00\\xb0dW5pY29kZSI\\xe0\\x00\\xd0udW1weV90eXBlp\\x00\\xa1Im9iamVjdC \\x00\\xa5tZXRhZGF0Y\\x18\\x01@x9LC\\x98\\x01\\x0fH\\x01\\x10TCJfX2\\xc0\\x01\\xc1xldmVsXzBfXy\\\\\\x00\\x0f\\\\\\x01>\\x80bnVsbH1d\\x1c\\x01\\xf0\\nY3JlYXRvciI6IHsibGlicmFye\\xc8\\x00\\xb1CJweWFycm93\\xa4\\x01\\xa1nZlcnNpb24\\xc0\\x01\\xa1MTEuMC4wIn\\x90\\x01\\x06\\xa8\\x00\\x80mVyc2lvbT\\x00\\xb0CIxLjUuMyJ9\\xc4\\x02\\x02\\xcb\\x02 BM\\n\\x00\\x10B\\x05\\x00\\xb1Mz///8AAAEF\\xe0\\x02\\x11CK\\x03\\x01\\x0b\\x00\\x01\\x02\\x00\\x10B\\x0b\\x00\\x1fB \\x01\\x03`wAAAMj@\\x00@QABQ\\x89\\x03`GAAcAD9\\x00\\x17BE\\x00!QUU\\x00\\x10H\\x18\\x00\\x02e\\x03\\x01\\x02\\x00\\x10B[\\x03\\x94F9ub25lXw3\\x00\\x01+\\x00\\x01\\x02\\x00\\xf1\\x00\\x00\\x18 parquet-cpp-9\\x04\\x13 \\x19\\x04\\x12 3\\x04P\\x19,\\x1c\\x00\\x00\\xdf\\x06\\x80\\x03\\x07\\x00\\x00PAR1\\x00\\x00\\x00\\x00'
+    b'00lz4__\\x04"M\\x18h@m\\x00\\x00\\x00\\x00\\x00\\x00\\x00DM\\x00\\x00\\x00\\x9a00colf_\\x02\\x00\\x01\\x00\\x13\\'\\x0f\\x00\\x13F\\x08\\x00\\xf3\\x11{"i":{"v":["a","b"],"n":null},"s\\n\\x00e00strsN\\x004\\x01\\x00\\x01Y\\x00P\\x01\\x01\\x0156\\x00\\x00\\x00\\x00'
     >>> unpack(b)
     a    5
     b    6
@@ -133,142 +146,1480 @@ def traversal_enc(obj, ensure_determinism, unsafe_fallback):
     y  6  2
     z  7  3
     """
-    error = None
-    if isinstance(obj, bytes):
+    ctx = Packing(ensure_determinism, unsafe_fallback, buffer_callback, indexed=indexed, dedup=dedup, cache=cache,
+                  version=version, canonical=canonical, records=records)
+    return _encode(obj, ctx)
+
+
+def _encode(obj, ctx):
+    typ = type(obj)
+    probe = typ not in _NOPROBE and typ not in _EXTENSIONS and typ.__module__ != "numpy"
+    if probe and not (ctx.records and _schema(obj, ctx)):
+        # Pure JSON (or else BSON) is by far the most common payload: a single C pass beats walking it in Python.
+        # When it fails, the graph is walked once and no codec is attempted again on the same subtree (but deep ones).
+        blob = _pure_blob(obj, ctx, b"" if ctx.version == 1 else MAGIC)
+        if blob is not None:
+            return blob
+    ctx.root = obj
+    blob = _finish(*_walk(obj, ctx), ctx)
+    if ctx.table:
+        if ctx.version == 1:
+            blob = _indexed_blob(b"00refs_", [*ctx.table, blob], ctx)
+        else:
+            blob = _seq_blob(b"refs_", [*ctx.table, blob], ctx)
+    if ctx.version == 2:
+        return Chunks([MAGIC, blob]) if ctx.chunked else MAGIC + blob
+    return blob
+
+
+def _pure_blob(obj, ctx, root=b""):
+    """
+    Blob of a subtree that orjson, or else bson, accepts as a whole (after the bytes 'root'), None otherwise.
+
+    BSON is only attempted on lists and dicts, and not with dedup, where bytes are shared instead.
+    >>> ctx = Packing(False, False)
+    >>> _pure_blob([1, "x"], ctx), _pure_blob([1, b"x"], ctx)[:7], _pure_blob([1, print], ctx)
+    (b'00json_[1,"x"]', b'00bson_', None)
+    """
+    try:
+        blob = root + ctx.heads[b"json_"] + orjson.dumps(obj, option=(ctx.json_option or 0) | _PASSTHROUGH)
+    except TypeError:  # Also beyond 254 levels of nesting.
+        pass
+    else:
+        if UUID not in _EXTENSIONS or not _UUID_TEXT.search(blob):
+            if instrument.ACTIVE is not None:
+                instrument.ACTIVE.record("encode", "json_", 0, len(blob), 0.0)
+            return blob
+    if not _BSON_PROBE or type(obj) not in (list, dict) or ctx.refs is not None:
+        return None
+    try:
+        blob = root + ctx.heads[b"bson_"] + bson.encode({"_": _sorted(obj) if ctx.canonical else obj})
+    except (InvalidDocument, OverflowError, TypeError, ValueError):
+        return None
+    if len(blob) - len(root) > _BSON_LIMIT:
+        return None
+    if instrument.ACTIVE is not None:
+        instrument.ACTIVE.record("encode", "bson_", 0, len(blob), 0.0)
+    return blob
+
+
+class Packing:
+    """
+    Per-call encoding options and state.
+
+    'buffer_callback' receives one flat 'memoryview' per ndarray, in the same spirit as pickle protocol 5:
+    the blob keeps only a reference by position and the array memory is never copied.
+
+    'chunked=True' makes containers and arrays come out as a tree of buffers ('Chunks')
+    holding the very same bytes, instead of being concatenated at every level.
+
+    'indexed=True' frames lists, tuples and dicts with a table of 64-bit offsets to their children
+    instead of a BSON document, so that a single child can be located and decoded alone (see 'lazy_unpack()').
+
+    'dedup=True' emits each ndarray, Series, DataFrame, bytes (from '_DEDUP_MIN' bytes on) and mixed container
+    once into a reference table, leaving back-references wherever the same object appears.
+    'dedup="content"' also merges equal bytes and ndarrays that are distinct objects.
+    Pure JSON/BSON subtrees are left alone, as they are folded into their parent's single orjson/bson call.
+
+    'cache' is a 'PackCache' reused across calls for ndarrays, Series and DataFrames.
+    It is ignored along with 'buffer_callback', as blobs would then depend on the buffer count.
+
+    'version=2' selects the compact format: one-byte tags instead of 7-byte headers,
+    varint-framed containers instead of BSON documents and binary ndarray descriptors (see 'MAGIC').
+    Indexed framing only exists in version 1.
+
+    'canonical=True' makes equal objects encode to the same bytes, whatever the insertion order of their dicts:
+    dict keys are sorted (str keys by value; other keys by value, or by their own encoding when not comparable),
+    and Fortran-ordered ndarrays are written in C order, like their C-ordered equals.
+
+    Lists of dicts sharing the same str keys are written as record batches, one column per key (see '_records_blob()').
+    A pure JSON (or BSON) payload is still dumped by orjson (or bson) in a single pass, unless 'records=True'.
+    """
+
+    __slots__ = ("ensure_determinism", "unsafe_fallback", "buffer_callback", "out_of_band", "nbuffers", "chunked", "indexed",
+                 "dedup", "leaves", "scalars", "refs", "table", "root", "cache", "version", "heads", "canonical",
+                 "json_option", "records", "depth")
+
+    def __init__(self, ensure_determinism, unsafe_fallback, buffer_callback=None, chunked=False, indexed=False, dedup=False,
+                 cache=None, version=1, canonical=False, records=False):
+        if version not in (1, 2):
+            raise Exception(f"Unknown format version: {version}")
+        if version == 2 and indexed:
+            raise Exception("Indexed framing ('indexed=True') is only available in format version 1.")
+        self.ensure_determinism = ensure_determinism
+        self.unsafe_fallback = unsafe_fallback
+        self.buffer_callback = buffer_callback
+        self.out_of_band = None if buffer_callback is None else self._out_of_band
+        self.nbuffers = 0
+        self.chunked = chunked
+        self.indexed = indexed
+        self.dedup = dedup
+        # With dedup, bytes are no longer leaves: they are walked to get a chance to be shared.
+        self.leaves, self.scalars = (_SHAREABLE_LEAVES, _SHAREABLE_SCALARS) if dedup else (_LEAVES, _SCALARS)
+        self.refs = {} if dedup else None
+        self.table = []
+        self.root = None
+        self.cache = cache if buffer_callback is None else None
+        self.version = version
+        self.heads = _HEADS if version == 1 else _TAGS
+        self.canonical = canonical
+        self.json_option = orjson.OPT_SORT_KEYS if canonical else None
+        self.records = records
+        self.depth = 0
+
+    def _out_of_band(self, view):
+        self.buffer_callback(view)
+        self.nbuffers += 1
+        return self.nbuffers - 1
+
+
+# Masks telling which whole-subtree codec accepts a node as it is.
+# Pure subtrees are deferred to the parent and serialized in a single call;
+# mixed ones have their children emitted one by one inside a container.
+JSON, BSON = 1, 2
+_LEAVES = {
+    str: JSON | BSON,
+    float: JSON | BSON,
+    bool: JSON | BSON,
+    type(None): JSON | BSON,
+    bytes: BSON,
+    datetime: JSON | BSON,
+    date: JSON,
+    time: JSON,
+    UUID: JSON,
+}
+_SCALARS = frozenset(_LEAVES) | {int}
+_NOPROBE = frozenset({bytes, tuple})
+_SHAREABLE_LEAVES = {typ: mask for typ, mask in _LEAVES.items() if typ is not bytes}
+_SHAREABLE_SCALARS = _SCALARS - {bytes}
+
+# Compact format (version 2): the dump starts with the 7-byte header 'MAGIC', then each node is a one-byte tag followed by
+# its body. Only the root is checked for it (see '_decode()'): nested version 1 nodes, e.g. raw bytes, are never taken for
+# a version 2 dump.
+MAGIC = b"00v2___"
+_NAMES = [b"json_", b"bson_", b"bint_", b"nmpy_", b"bsos_", b"prqs_", b"prqd_", b"colf_", b"strs_",
+          b"list_", b"tupl_", b"dict_", b"dicB_", b"refs_", b"dref_", b"pckl_", b"dill_", b"byts_", b"npsc_",
+          b"dicK_", b"recb_", b"extn_"]
+_TAGS = {name: bytes([i + 1]) for i, name in enumerate(_NAMES)}
+_HEADS = {name: (b"05" if name in (b"pckl_", b"dill_") else b"00") + name for name in _NAMES}
+_SMALL = [bytes([i]) for i in range(128)]
+
+
+def _varint(n):
+    """
+    Unsigned LEB128.
+
+    >>> _varint(5), _varint(300), _read_varint(_varint(2**40), 0)
+    (b'\\x05', b'\\xac\\x02', (1099511627776, 6))
+    """
+    if n < 128:
+        return _SMALL[n]
+    out = bytearray()
+    while n >= 128:
+        out.append(n & 127 | 128)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(blob, pos):
+    """Varint at 'blob[pos:]' and the position after it."""
+    b = blob[pos]
+    if b < 128:
+        return b, pos + 1
+    n, shift = b & 127, 7
+    while True:
+        pos += 1
+        b = blob[pos]
+        n |= (b & 127) << shift
+        if b < 128:
+            return n, pos + 1
+        shift += 7
+
+
+def _walk(obj, ctx):
+    """
+    Single pass over the object graph.
+
+    Return a triple '(mask, obj, parts)'. When 'mask' is zero, 'obj' is already the encoded blob.
+    'parts' keeps the walked children of a pure tuple, in case it needs to be emitted on its own.
+    >>> _walk([1, "a"], Packing(False, False))
+    (3, [1, 'a'], None)
+    >>> _walk([1, b"a"], Packing(False, False))
+    (2, [1, b'a'], None)
+    >>> _walk(2**70, Packing(False, False))
+    (0, b'00bint_1180591620717411303424', None)
+
+    Pure subtrees below '_DEEP' levels are encoded whole by orjson/bson, which nest far deeper than a Python walk.
+    >>> deep = [b"x"]
+    >>> for _ in range(800):
+    ...     deep = [deep]
+    >>> obj = {"big": 2**70, "deep": deep}
+    >>> unpack(pack(obj, ensure_determinism=True, unsafe_fallback=False)) == obj
+    True
+    """
+    typ = type(obj)
+    mask = ctx.leaves.get(typ)
+    if mask is not None:
+        return mask, obj, None
+    if typ is int:
+        mask = _int_mask(obj, obj)
+        if mask:
+            return mask, obj, None
+        blob = _bigint(obj, ctx)
+        if instrument.ACTIVE is not None:
+            instrument.ACTIVE.record("encode", "bint_", 0, len(blob), 0.0)
+        return 0, blob, None
+    if ctx.depth > _DEEP and (blob := _pure_blob(obj, ctx)) is not None:
+        return 0, blob, None
+    ctx.depth += 1
+    if ctx.refs is not None and obj is not ctx.root:
+        walked = _shared(obj, typ, ctx)
+    elif typ in _CONTAINERS and instrument.ACTIVE is None:  # Saves a frame per nesting level.
+        walked = _CONTAINERS[typ](obj, ctx)
+    else:
+        walked = _dispatch(obj, typ, ctx)
+    ctx.depth -= 1
+    return walked
+
+
+# Containers nested deeper than this are first offered whole to orjson/bson, which do not recurse in Python.
+_DEEP = 32
+
+
+def _dispatch(obj, typ, ctx, traced=False):
+    if instrument.ACTIVE is not None and not traced:
+        start = perf_counter()
+        mask, blob, parts = _dispatch(obj, typ, ctx, True)
+        if not mask:
+            instrument.ACTIVE.record("encode", _header(blob), 0, _nbytes(blob), perf_counter() - start)
+        return mask, blob, parts
+    encoder = _ENCODERS.get(typ)
+    if encoder is None:
+        encoder = _ENCODERS_BY_NAME.get(f"{typ.__module__}.{typ.__qualname__}")
+        if encoder is None and typ.__module__ == "numpy":
+            import numpy as np
+
+            if issubclass(typ, np.generic):  # Scalar types are too many (and platform dependent) to be listed by name.
+                encoder = _enc_npscalar
+        if encoder is None:
+            return _fallback(obj, ctx)
+        _ENCODERS[typ] = encoder
+    if ctx.cache is not None and encoder in _CACHEABLE:
+        options = ctx.ensure_determinism, ctx.unsafe_fallback, ctx.chunked, ctx.version, ctx.canonical
+        blob = ctx.cache.get(obj, options)
+        if blob is None:
+            _, blob, _ = encoder(obj, ctx)
+            ctx.cache.put(obj, options, blob)
+        return 0, blob, None
+    return encoder(obj, ctx)
+
+
+_DEDUP_MIN = 64
+
+
+def _shared(obj, typ, ctx):
+    """Walk 'obj' in dedup mode: blobs are emitted into the reference table and replaced by a back-reference."""
+    if typ is bytes and len(obj) < _DEDUP_MIN:
+        return BSON, obj, None
+    entry = ctx.refs.get(id(obj))
+    if entry is None:
+        digest = _digest(obj, typ) if ctx.dedup == "content" else None
+        entry = ctx.refs.get(digest)
+        if entry is None:
+            mask, blob, parts = (0, _finish(BSON, obj, None, ctx), None) if typ is bytes else _dispatch(obj, typ, ctx)
+            if mask:
+                return mask, blob, parts
+            ctx.table.append(blob)
+            entry = len(ctx.table) - 1, obj  # The object is kept alive, so that its id is not reused meanwhile.
+            if digest is not None:
+                ctx.refs[digest] = entry
+        ctx.refs[id(obj)] = entry
+    if ctx.version == 2:
+        return 0, _TAGS[b"dref_"] + _varint(entry[0]), None
+    return 0, b"00dref_" + entry[0].to_bytes(8, byteorder="little"), None
+
+
+def _digest(obj, typ):
+    from hashlib import blake2b
+
+    if typ is bytes:
+        return blake2b(obj, digest_size=32).digest()
+    if f"{typ.__module__}.{typ.__qualname__}" == "numpy.ndarray" and not obj.dtype.hasobject:
+        import numpy as np
+
+        h = blake2b(f"{obj.dtype.str}{obj.shape}".encode(), digest_size=32)
+        h.update(memoryview(np.ascontiguousarray(obj).reshape(-1).view(np.uint8)))
+        return h.digest()
+
+
+def _bigint(obj, ctx):
+    """Version 1 keeps the decimal text, version 2 the two's complement little endian bytes."""
+    if ctx.version == 1:
+        return b"00bint_" + str(obj).encode()
+    return _TAGS[b"bint_"] + int(obj).to_bytes(obj.bit_length() // 8 + 1, byteorder="little", signed=True)
+
+
+def _int_mask(lo, hi):
+    if -9223372036854775808 <= lo and hi <= 9223372036854775807:
+        return JSON | BSON
+    if 0 <= lo and hi <= 18446744073709551615:
+        return JSON
+    return 0
+
+
+def _scalars_mask(values, types):
+    """Mask of a flat collection of scalars, computed per distinct type instead of per item. Zero needs a closer look."""
+    mask = JSON | BSON
+    for typ in types:
+        if typ is int:
+            ints = values if len(types) == 1 else [v for v in values if type(v) is int]
+            mask &= _int_mask(min(ints), max(ints))
+        else:
+            mask &= _LEAVES[typ]
+    return mask
+
+
+def _finish(mask, obj, parts, ctx):
+    """Emit a walked node as a standalone blob."""
+    if not mask:
         return obj
-    if isinstance(obj, tuple):
-        lst_of_binaries = tuple(traversal_enc(o, ensure_determinism, unsafe_fallback) for o in obj)
-        return b"00tupl_" + bson.encode({"_": lst_of_binaries})
+    if parts is not None:
+        return _seq_blob(b"tupl_", tuple(_finish(*part, ctx) for part in parts), ctx)
+    if type(obj) is bytes:
+        if ctx.version == 1:
+            return obj
+        return Chunks([_TAGS[b"byts_"], obj]) if ctx.chunked else _TAGS[b"byts_"] + obj
+    if mask & JSON:
+        blob = ctx.heads[b"json_"] + orjson.dumps(obj, option=ctx.json_option)
+    elif (blob := _bson_blob(obj, ctx)) is None:  # Would overflow the BSON size limit: frame the children separately.
+        if isinstance(obj, dict):
+            keys = sorted(obj) if ctx.canonical else obj
+            return _map_blob(b"dict_", {k: _finish(*_walk(obj[k], ctx), ctx) for k in keys}, ctx)
+        return _seq_blob(b"list_", [_finish(*_walk(o, ctx), ctx) for o in obj], ctx)
+    if instrument.ACTIVE is not None:
+        instrument.ACTIVE.record("encode", _header(blob), 0, len(blob), 0.0)
+    return blob
+
+
+def _bson_blob(obj, ctx):
+    """Blob of a pure BSON node, None when it does not fit in a BSON document."""
+    try:
+        blob = ctx.heads[b"bson_"] + bson.encode({"_": _sorted(obj) if ctx.canonical else obj})
+    except ValueError:
+        return None
+    return blob if len(blob) <= _BSON_LIMIT else None
+
+
+def _sorted(obj):
+    """Copy of a pure BSON subtree with the keys of every dict sorted."""
+    if isinstance(obj, dict):
+        return {k: _sorted(obj[k]) for k in sorted(obj)}
+    if isinstance(obj, (list, tuple)):
+        return [_sorted(o) for o in obj]
+    return obj
+
+
+def _enc_list(obj, ctx):
+    if (keys := _schema(obj, ctx)) is not None:
+        return 0, _records_blob(obj, keys, ctx), None
+    types = set(map(type, obj))
+    if types <= ctx.scalars and (mask := _scalars_mask(obj, types)):
+        return mask, obj, None
+    parts, mask, leaves = [], JSON | BSON, ctx.leaves
+    for o in obj:
+        m = leaves.get(type(o))
+        part = (m, o, None) if m is not None else _walk(o, ctx)
+        mask &= part[0]
+        parts.append(part)
+    if mask:
+        return mask, obj, None
+    return 0, _seq_blob(b"list_", [_finish(*part, ctx) for part in parts], ctx), None
+
+
+_RECORDS_MIN = 16
+
+
+def _schema(obj, ctx):
+    """
+    Keys shared by all rows of a list of at least '_RECORDS_MIN' dicts, in the same order (sorted, if canonical), or None.
+
+    Indexed packing keeps lists of dicts row by row, for 'lazy_unpack()'.
+    """
+    if type(obj) is not list or len(obj) < _RECORDS_MIN or type(obj[0]) is not dict or not obj[0] or ctx.indexed:
+        return None
+    keys = list(obj[0])
+    if set(map(type, obj)) != {dict} or set(map(type, keys)) != {str}:
+        return None
+    if ctx.canonical:
+        first = obj[0].keys()
+        return sorted(keys) if all(map(first.__eq__, map(dict.keys, obj))) else None
+    return keys if all(map(keys.__eq__, map(list, obj))) else None
+
+
+def _records_blob(rows, keys, ctx):
+    """
+    Record batch: a list of dicts sharing the same str keys, transposed into one column per key.
+
+    The keys are stored once, as a JSON list. Columns of int64, float or bool values become ndarrays,
+    str columns are dictionary-encoded (see 'serialize_strings()'), other columns are encoded as lists.
+    >>> rows = [{"id": i, "w": i / 2, "tag": "ab"[i % 2], "raw": bytes([i])} for i in range(20)]
+    >>> blob = traversal_enc(rows, False, False, records=True)
+    >>> blob[:7], traversal_dec(blob) == rows
+    (b'00recb_', True)
+    >>> unpack_records(blob, to="frame").dtypes.tolist()
+    [dtype('int64'), dtype('float64'), dtype('O'), dtype('O')]
+    """
+    blobs = [orjson.dumps(keys)]
+    for key in keys:
+        column = list(map(itemgetter(key), rows))
+        array = _record_array(column)
+        if array is not None:
+            blobs.append(_numpy_blob(array, ctx, False))
+        elif set(map(type, column)) == {str} and _has_pandas():
+            blobs.append(ctx.heads[b"strs_"] + serialize_strings(column))
+        else:
+            blobs.append(_finish(*_enc_list(column, ctx), ctx))
+    if ctx.version == 2:
+        return _seq_blob(b"recb_", blobs, ctx)
+    return _indexed_blob(b"00recb_", blobs, ctx)
+
+
+def _record_array(column):
+    """Column of int64, float or bool values as an ndarray, None otherwise (or without numpy)."""
+    types = set(map(type, column))
+    if len(types) != 1 or (typ := next(iter(types))) not in (int, float, bool):
+        return None
+    if typ is int and not _int_mask(min(column), max(column)) & BSON:
+        return None
+    try:
+        import numpy as np
+    except ImportError:  # pragma: no cover
+        return None
+    return np.array(column, dtype=np.int64 if typ is int else np.float64 if typ is float else np.bool_)
+
+
+def _has_pandas():
+    try:
+        import pandas  # noqa: F401
+    except ImportError:  # pragma: no cover
+        return False
+    return True
+
+
+def _enc_tuple(obj, ctx):
+    parts = [_walk(o, ctx) for o in obj]
+    mask = JSON | BSON
+    for part in parts:
+        mask &= part[0]
+    if mask:
+        # Nested pure tuples become lists inside the parent, like orjson/bson do.
+        return mask, obj, parts
+    return 0, _seq_blob(b"tupl_", tuple(_finish(*part, ctx) for part in parts), ctx), None
+
+
+def _enc_dict(obj, ctx):
+    strkeys = set(map(type, obj)) == {str} or not obj
+    if ctx.canonical and len(obj) > 1:
+        obj = _sorted_dict(obj, strkeys, ctx)
+    types = set(map(type, obj.values()))
+    if types <= ctx.scalars and (mask := _scalars_mask(obj.values(), types)):
+        if strkeys:
+            return mask, obj, None
+        if not ctx.indexed:
+            return 0, _keyed_blob(obj, None, mask, ctx), None
+    parts, mask, leaves = [], JSON | BSON, ctx.leaves
+    for k, o in obj.items():
+        m = leaves.get(type(o))
+        part = (m, o, None) if m is not None else _walk(o, ctx)
+        mask &= part[0]
+        parts.append((k, part))
+    if strkeys:
+        if mask:
+            return mask, obj, None
+        return 0, _map_blob(b"dict_", {k: _finish(*part, ctx) for k, part in parts}, ctx), None
+    if ctx.indexed:  # Keys stay next to their values, so that 'lazy_unpack()' can look them up one by one.
+        blobs = []
+        for k, part in parts:
+            blobs.append(_finish(*_walk(k, ctx), ctx))
+            blobs.append(_finish(*part, ctx))
+        return 0, _indexed_blob(b"00idcB_", blobs, ctx), None
+    return 0, _keyed_blob(obj, [part for k, part in parts], mask, ctx), None
+
+
+def _keyed_blob(obj, parts, mask, ctx):
+    """
+    Dict with non-str keys as two children: the sequence of keys, then the sequence of values.
+
+    Homogeneous int64, float and naive datetime keys become a single ndarray, other scalar keys a single JSON/BSON list;
+    only keys that are containers (e.g., tuples) or need their own codec are encoded one by one.
+    Values are walked 'parts' of a mixed dict, or None when they are all scalars accepted by 'mask'.
+    >>> obj = {1: "a", 2: [3, b"x"], -5: None}
+    >>> blob = traversal_enc(obj, False, False)
+    >>> blob[:7], traversal_dec(blob) == obj
+    (b'00dicK_', True)
+    >>> from datetime import datetime
+    >>> obj = {datetime(2023, 1, 1, 12, 30, 0, 5): 0, datetime(2024, 2, 29): 1}
+    >>> traversal_dec(traversal_enc(obj, False, False)) == obj
+    True
+    >>> obj = {(1, "a"): (0, 1), (2, "b"): 1, 2.5: 2}
+    >>> traversal_dec(traversal_enc(obj, False, False)) == obj
+    True
+    """
+    keys = list(obj)
+    types = set(map(type, keys))
+    kmask = _scalars_mask(keys, types) if types <= _SCALARS else 0
+    array = _key_array(keys, types, kmask)
+    if array is not None:
+        kblob = serialize_numpy(array, False, False, ctx.heads[b"nmpy_"], None, False, ctx.version)
+    else:
+        if kmask:
+            kblob = _finish(kmask, keys, None, ctx)
+        else:
+            kblob = _seq_blob(b"list_", [_finish(*_walk(k, ctx), ctx) for k in keys], ctx)
+    if parts is None:
+        vblob = _finish(mask, list(obj.values()), None, ctx)
+    elif mask and all(part[2] is None for part in parts):  # No tuples, which a single JSON/BSON list would turn into lists.
+        vblob = _finish(mask, [part[1] for part in parts], None, ctx)
+    else:
+        vblob = _seq_blob(b"list_", [_finish(*part, ctx) for part in parts], ctx)
+    if ctx.version == 2:
+        return _framed(_TAGS[b"dicK_"], [kblob, vblob], ctx)
+    return _indexed_blob(b"00dicK_", [kblob, vblob], ctx)
+
+
+def _sorted_dict(obj, strkeys, ctx):
+    """Copy of 'obj' with sorted keys. Keys that cannot be compared are ordered by their encoding."""
+    if not strkeys:
+        try:
+            return {k: obj[k] for k in sorted(obj)}
+        except TypeError:
+            pass
+
+        # No side effect on 'ctx'.
+        keyctx = Packing(ctx.ensure_determinism, ctx.unsafe_fallback, version=ctx.version, canonical=True)
+
+        def key(k):
+            return _finish(*_walk(k, keyctx), keyctx)
+
+        return {k: obj[k] for k in sorted(obj, key=key)}
+    return {k: obj[k] for k in sorted(obj)}
+
+
+_EPOCH, _MICROSECOND = datetime(1970, 1, 1), timedelta(microseconds=1)
+
 
+def _key_array(keys, types, mask):
+    """Homogeneous int64, float or naive datetime keys as an ndarray, None otherwise (or without numpy)."""
+    if len(types) != 1 or (typ := next(iter(types))) not in (int, float, datetime) or typ is int and not mask & BSON:
+        return None
     try:
-        return b"00json_" + orjson.dumps(obj)
+        import numpy as np
+    except ImportError:  # pragma: no cover
+        return None
+    if typ is datetime:
+        if any(k.tzinfo is not None for k in keys):
+            return None
+        # Integer arithmetic is much faster than letting numpy convert each datetime object.
+        return np.array([(k - _EPOCH) // _MICROSECOND for k in keys], dtype=np.int64).view("datetime64[us]")
+    return np.array(keys, dtype=np.int64 if typ is int else np.float64)
+
+
+def _enc_ndarray(obj, ctx):
+    if ctx.unsafe_fallback and obj.dtype.hasobject:
+        return _unsafe(obj, ctx, f"Cannot handle this ndarray dtype: '{obj.dtype}'")
+    if ctx.canonical and not obj.flags.c_contiguous and obj.flags.f_contiguous:
+        import numpy as np
+
+        obj = np.ascontiguousarray(obj)
+    return 0, _numpy_blob(obj, ctx, ctx.unsafe_fallback), None
+
+
+def _numpy_blob(obj, ctx, unsafe_fallback):
+    """'serialize_numpy()' with the header, out-of-band buffers, chunking and version of 'ctx'."""
+    head = ctx.heads[b"nmpy_"]
+    return serialize_numpy(obj, ctx.ensure_determinism, unsafe_fallback, head, ctx.out_of_band, ctx.chunked, ctx.version)
+
+
+def _enc_npscalar(obj, ctx):
+    """Numpy scalar as the binary descriptor of a 0-d array (see '_numpy_head()') followed by its bytes."""
+    import numpy as np
+
+    arr = np.asarray(obj)
+    return 0, ctx.heads[b"npsc_"] + _numpy_head(arr, 0) + arr.tobytes(), None
+
+
+def _enc_series(obj, ctx):
+    try:
+        if type(obj.name) in _LABELS:
+            return 0, serialize_series(obj, ctx), None
+        return 0, _bsos_blob(obj, ctx), None
+    except Exception as e:
+        if not str(e).startswith("Please enable 'unsafe_fallback'"):
+            return _unsafe(obj, ctx, str(e))
+        _trace_fallback(obj, ctx, "prqs_", str(e))
+    try:
+        return 0, ctx.heads[b"prqs_"] + obj.to_frame(obj.name or "_none_").to_parquet(), None  # .convert_dtypes().to_parquet()
+    except Exception as e:
+        return _unsafe(obj, ctx, str(e))
+
+
+def _bsos_blob(obj, ctx):
+    """Series as a BSON document of its index labels, name and values (the latter as a numpy blob)."""
+    idx = obj.index.values.tolist()
+    vals = serialize_numpy(obj.to_numpy(), ctx.ensure_determinism, False, b"", ctx.out_of_band, ctx.chunked, ctx.version)
+    dic = {"i": idx, "v": vals}
+    if obj.name is not None:
+        dic["n"] = obj.name
+    if ctx.version == 2:  # Metadata document, then the array body.
+        del dic["v"]
+        meta = bson.encode(dic)
+        head = _TAGS[b"bsos_"] + _varint(len(meta)) + meta
+        return Chunks([head, vals]) if ctx.chunked else head + vals
+    if _nbytes(vals) + 32 * len(idx) > _BSON_LIMIT:  # Too large for a single document: metadata and values, located by offset.
+        del dic["v"]
+        return _indexed_blob(_INDEXED[b"bsos_"], [bson.encode(dic), vals], ctx)
+    if ctx.chunked:
+        elements = [_binary_element(k, v) if k == "v" else bson.encode({k: v})[4:-1] for k, v in dic.items()]
+        return Chunks([b"00bsos_", _bson_doc(elements)])
+    return b"00bsos_" + bson.encode(dic)
+
+
+def _enc_dataframe(obj, ctx):
+    try:
+        return 0, serialize_frame(obj, ctx), None
+    except Exception as e:
+        if not str(e).startswith("Please enable 'unsafe_fallback'"):
+            return _unsafe(obj, ctx, str(e))
+        _trace_fallback(obj, ctx, "prqd_", str(e))
+    try:
+        return 0, ctx.heads[b"prqd_"] + obj.to_parquet(), None
+    except Exception as e:
+        return _unsafe(obj, ctx, str(e))
+
+
+def _fallback(obj, ctx):
+    """Old cascade, only reached by types without a dispatch entry (subclasses, exotic types)."""
+    error = None
+    try:
+        return 0, ctx.heads[b"json_"] + orjson.dumps(obj), None
     except TypeError as e:
         error = str(e)
+        _trace_fallback(obj, ctx, "bson_", error)
     try:
-        return b"00bson_" + bson.encode({"_": obj})
+        return 0, ctx.heads[b"bson_"] + bson.encode({"_": obj}), None
     except InvalidDocument as e:
         error = str(e)
     except OverflowError as o:
         if "8-byte ints" in str(o) and isinstance(obj, int):
-            return b"00bint_" + str(obj).encode()
-
+            return 0, _bigint(obj, ctx), None
+    if isinstance(obj, tuple):
+        return _enc_tuple(obj, ctx)
     if isinstance(obj, list):
-        lst_of_binaries = [traversal_enc(o, ensure_determinism, unsafe_fallback) for o in obj]
-        return b"00list_" + bson.encode({"_": lst_of_binaries})
-    elif isinstance(obj, dict):
-        dic_of_binaries = {}
-        hexfy = any(not isinstance(k, str) for k in obj.keys())
-        prefix = b"00dicB_" if hexfy else b"00dict_"
-        for k, o in obj.items():
-            if hexfy:
-                bk = traversal_enc(k, ensure_determinism, unsafe_fallback)
-                k = hexlify(bk).decode("utf-8")
-            dic_of_binaries[k] = traversal_enc(o, ensure_determinism, unsafe_fallback)
-        return prefix + bson.encode(dic_of_binaries)
-
-    klass = str(obj.__class__)
-    if klass in ["<class 'numpy.ndarray'>"]:
-        return serialize_numpy(obj, ensure_determinism, unsafe_fallback)
-    elif klass == "<class 'pandas.core.series.Series'>":
-        try:
-            idx = obj.index.values.tolist()
-            vals = serialize_numpy(obj.to_numpy(), ensure_determinism, False, b"")
-            dic = {"i": idx, "v": vals}
-            if obj.name is not None:
-                dic["n"] = obj.name
-            return b"00bsos_" + bson.encode(dic)
-        except Exception as e:
-            if str(e).startswith("Please enable 'unsafe_fallback'"):
-                from pandas import DataFrame
-
-                try:
-                    return b"00prqs_" + obj.to_frame(obj.name or "_none_").to_parquet()  # .convert_dtypes().to_parquet()
-                except Exception as e:
-                    error = str(e)
-    elif klass == "<class 'pandas.core.frame.DataFrame'>":
-        try:
-            return serialize_numpy(obj.to_numpy(), ensure_determinism, unsafe_fallback=False, prefix=b"00npdf_")
-        except Exception as e:
-            if str(e).startswith("Please enable 'unsafe_fallback'"):
-                try:
-                    return b"00prqd_" + obj.to_parquet()
-                except Exception as e:
-                    error = str(e)
-    if unsafe_fallback:
-        return topickle(obj, ensure_determinism)
+        return _enc_list(obj, ctx)
+    if isinstance(obj, dict):
+        return _enc_dict(obj, ctx)
+    return _unsafe(obj, ctx, error)
+
+
+def _unsafe(obj, ctx, error):
+    if ctx.unsafe_fallback:
+        blob = topickle(obj, ctx.ensure_determinism)
+        if ctx.version == 2:
+            blob = _TAGS[blob[2:7]] + memoryview(blob)[7:]
+        _trace_fallback(obj, ctx, _header(blob), error)
+        return 0, blob, None
     raise Exception(f"Cannot safely pack {type(obj)}: {error}")  # pragma: no cover
     # TODO: handle hdict?
 
 
-def traversal_dec(dump):
+def _trace_fallback(obj, ctx, to, error):
+    """Report a step down the fallback cascade to the active 'Stats', if any."""
+    if instrument.ACTIVE is not None:
+        instrument.ACTIVE.fallback(_path(ctx.root, obj), type(obj), to, error)
+
+
+def _path(root, obj):
+    """
+    Path from 'root' to 'obj' through lists, tuples and dict values, as indexing code. Only computed when tracing fallbacks.
+
+    >>> _path({"a": [1, {"b": print}]}, print)
+    "['a'][1]['b']"
+    >>> _path([1], print) is None
+    True
+    """
+    stack, seen = [(root, "")], set()
+    while stack:
+        node, path = stack.pop()
+        if node is obj:
+            return path
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, (list, tuple)):
+            stack.extend((child, f"{path}[{i}]") for i, child in reversed(list(enumerate(node))))
+        elif isinstance(node, dict):
+            stack.extend((child, f"{path}[{k!r}]") for k, child in reversed(list(node.items())))
+    return None
+
+
+class Chunks(list):
+    """
+    Encoded blob kept as a tree of buffers (bytes, memoryviews or other Chunks), with its total size.
+
+    >>> c = Chunks([b"ab", Chunks([memoryview(b"cde")]), b"f"])
+    >>> c.nbytes, b"".join(c.leaves())
+    (6, b'abcdef')
+    """
+
+    __slots__ = ("nbytes",)
+
+    def __init__(self, parts):
+        super().__init__(parts)
+        self.nbytes = sum(len(p) if type(p) is bytes else p.nbytes for p in parts)
+
+    def leaves(self):
+        for p in self:
+            if type(p) is Chunks:
+                yield from p.leaves()
+            else:
+                yield p
+
+
+def _nbytes(blob):
+    return len(blob) if type(blob) is bytes else blob.nbytes
+
+
+def _header(blob):
+    """Header of an encoded blob (either format), e.g., 'list_'."""
+    first = blob if type(blob) is bytes else next(blob.leaves())
+    if first[0] <= len(_NAMES):
+        return _NAMES[first[0] - 1].decode()
+    return bytes(first[2:7]).decode()
+
+
+_BSON_LIMIT = 2147483647  # BSON documents are framed by int32 lengths.
+
+
+def _oversized(blobs, keys=()):
+    """
+    Whether a BSON document holding 'blobs' (under 'keys', if a dict) might not fit in '_BSON_LIMIT'.
+
+    Such containers switch to the indexed layout, framed by uint64 offsets (see '_indexed_blob()').
+    >>> from safeserializer import pack, unpack
+    >>> import safeserializer.compression as c
+    >>> limit, c._BSON_LIMIT = c._BSON_LIMIT, 100
+    >>> obj = {"a": [b"x" * 60, b"y" * 60], "b": (b"z" * 60, 2**70)}
+    >>> blob = pack(obj, ensure_determinism=True, unsafe_fallback=False, compressed=False)
+    >>> blob[:7], unpack(blob) == obj
+    (b'00idct_', True)
+    >>> c._BSON_LIMIT = limit
+    >>> pack(obj, ensure_determinism=True, unsafe_fallback=False, compressed=False)[:7]
+    b'00dict_'
+    """
+    size = sum(map(_nbytes, blobs)) + 32 * len(blobs)  # Element type, index key, subtype and length: under 32 bytes.
+    return size + 4 * sum(map(len, keys)) > _BSON_LIMIT  # Up to 4 bytes per key character (utf-8).
+
+
+def _bson_doc(elements):
+    """Frame already encoded BSON elements as a document, without concatenating them."""
+    size = 5 + sum(map(_nbytes, elements))
+    if size > _BSON_LIMIT:
+        raise InvalidDocument(f"BSON document too large ({size} bytes)")
+    return Chunks([size.to_bytes(4, byteorder="little"), *elements, b"\x00"])
+
+
+def _binary_element(key, blob):
+    if "\x00" in key:
+        raise InvalidDocument("Key names must not contain the NULL byte")
+    return Chunks([b"\x05" + key.encode() + b"\x00" + _nbytes(blob).to_bytes(4, byteorder="little") + b"\x00", blob])
+
+
+def _seq_blob(name, blobs, ctx):
+    """Header + BSON document '{"_": blobs}' (version 1, indexed when too large) or tag + varint-framed blobs (version 2)."""
+    if ctx.version == 2:
+        return _framed(_TAGS[name], blobs, ctx)
+    if ctx.indexed or _oversized(blobs):
+        return _indexed_blob(_INDEXED[name], blobs, ctx)
+    prefix = b"00" + name
+    if not ctx.chunked:
+        return prefix + bson.encode({"_": blobs})
+    array = _bson_doc([_binary_element(str(i), blob) for i, blob in enumerate(blobs)])
+    return Chunks([prefix, _bson_doc([Chunks([b"\x04_\x00", array])])])
+
+
+def _map_blob(name, blobs, ctx):
+    """
+    Header + BSON document 'blobs' (version 1, indexed when too large for BSON),
+    or tag + varint-framed alternating utf-8 keys and blobs (version 2).
+    """
+    if ctx.version == 2:
+        return _framed(_TAGS[name], [b for k, blob in blobs.items() for b in (k.encode(), blob)], ctx)
+    if ctx.indexed or _oversized(blobs.values(), blobs):
+        return _indexed_blob(_INDEXED[name], [b for k, blob in blobs.items() for b in (k.encode(), blob)], ctx)
+    prefix = b"00" + name
+    if not ctx.chunked:
+        return prefix + bson.encode(blobs)
+    return Chunks([prefix, _bson_doc([_binary_element(k, blob) for k, blob in blobs.items()])])
+
+
+_INDEXED = {b"list_": b"00ilst_", b"tupl_": b"00itpl_", b"dict_": b"00idct_", b"dicB_": b"00idcB_", b"bsos_": b"00isrs_"}
+
+
+def _framed(tag, blobs, ctx):
+    """
+    'tag' + number of children + each child preceded by its size, all as varints.
+
+    >>> _framed(_TAGS[b"list_"], [b"ab", b"c"], Packing(False, False, version=2))
+    b'\\n\\x02\\x02ab\\x01c'
+    >>> [bytes(c) for c in frames(memoryview(_)[1:])]
+    [b'ab', b'c']
+    """
+    parts = [tag, _varint(len(blobs))]
+    for blob in blobs:
+        parts.append(_varint(_nbytes(blob)))
+        parts.append(blob)
+    return Chunks(parts) if ctx.chunked else b"".join(parts)
+
+
+def frames(blob):
+    """Slices of 'blob' (body of a version 2 container, after its tag) holding each child."""
+    n, pos = _read_varint(blob, 0)
+    children = []
+    for _ in range(n):
+        size = blob[pos]
+        if size < 128:
+            pos += 1
+        else:
+            size, pos = _read_varint(blob, pos)
+        children.append(blob[pos : pos + size])
+        pos += size
+    return children
+
+
+def _indexed_blob(prefix, blobs, ctx):
+    """
+    'prefix' + number of children + their offsets (n+1 little endian uint64) + the children themselves.
+
+    Dicts alternate keys and values: utf-8 keys for 'idct_', encoded keys for 'idcB_'.
+    >>> blob = _indexed_blob(b"00ilst_", [b"ab", b"c"], Packing(False, False))
+    >>> blob[:7], struct.unpack("<4Q", blob[7:39]), blob[39:]
+    (b'00ilst_', (2, 0, 2, 3), b'abc')
+    """
+    offsets, offset = [0], 0
+    for blob in blobs:
+        offset += _nbytes(blob)
+        offsets.append(offset)
+    head = prefix + struct.pack(f"<{len(offsets) + 1}Q", len(blobs), *offsets)
+    if ctx.chunked:
+        return Chunks([head, *blobs])
+    return b"".join([head, *blobs])
+
+
+def indexed_children(blob):
+    """Slices of 'blob' (body of an indexed container, after its 7-byte prefix) holding each child."""
+    n = int.from_bytes(bytes(blob[:8]), byteorder="little")
+    offsets = struct.unpack(f"<{n + 1}Q", bytes(blob[8 : 16 + 8 * n]))
+    start = 16 + 8 * n
+    return [blob[start + offsets[i] : start + offsets[i + 1]] for i in range(n)]
+
+
+# Exact-type dispatch. Optional dependencies are matched by qualified name and cached by type at first sight.
+_CONTAINERS = {list: _enc_list, tuple: _enc_tuple, dict: _enc_dict}
+_ENCODERS = dict(_CONTAINERS)
+_ENCODERS_BY_NAME = {
+    "numpy.ndarray": _enc_ndarray,
+    "pandas.core.series.Series": _enc_series,
+    "pandas.core.frame.DataFrame": _enc_dataframe,
+}
+_CACHEABLE = frozenset(_ENCODERS_BY_NAME.values())
+
+# Registered extension types: type -> (tag, encode), and tag -> decode. See 'register_type()'.
+_EXTENSIONS, _EXTENSION_DECODERS = {}, {}
+# Masks of the registered leaf types, restored by 'unregister_type()'.
+_REGISTERED_LEAVES = {}
+# orjson would dump registered dataclasses and datetimes by itself: let them fail the pure JSON attempt instead.
+# It cannot be told so for UUIDs: once registered, a dump holding a str that looks like one is discarded (see '_encode()').
+_PASSTHROUGH, _BSON_PROBE = 0, True
+_UUID_TEXT = re.compile(rb'"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"')
+
+
+def register_type(cls, tag, encode=None, decode=None):
+    """
+    Pack instances of exactly 'cls' as the state 'encode(obj)' labeled with the str 'tag'; 'decode(state)' rebuilds them.
+
+    The state is packed as any other object, e.g., a list of leaves goes through a single orjson call.
+    Without 'encode'/'decode', NamedTuples, dataclasses and '__slots__' classes are kept field by field, as a list,
+    and rebuilt without calling '__init__'.
+    Unpacking only calls the decoder registered under the tag it finds, never an arbitrary type as pickle does.
+    Some standard types are registered by default: set, frozenset, Decimal, timedelta and complex.
+
+    datetime, date, time and UUID are JSON/BSON leaves, written as strings by orjson, which they come back as.
+    Registering them gives exact round trips (time zones included) through built-in handlers, at a cost:
+    payloads holding them are walked in Python instead of being dumped by orjson at once
+    (for UUID, payloads holding strings that look like one too).
+
+    >>> from typing import NamedTuple
+    >>> class Point(NamedTuple):
+    ...     x: float
+    ...     y: float
+    >>> register_type(Point, "point")
+    >>> blob = pack({Point(1.5, 2): {3, 2}}, ensure_determinism=True, unsafe_fallback=False)
+    >>> unpack(blob)
+    {Point(x=1.5, y=2): {2, 3}}
+    >>> register_type(tuple, "point")
+    Traceback (most recent call last):
+    ...
+    Exception: Type tag 'point' is already taken by <class 'safeserializer.compression.Point'>.
+    >>> from uuid import UUID
+    >>> register_type(UUID, "uuid")
+    >>> unpack(pack([UUID(int=5), "x"], ensure_determinism=True, unsafe_fallback=False))
+    [UUID('00000000-0000-0000-0000-000000000005'), 'x']
+    >>> unregister_type(UUID)
+    >>> unregister_type(Point)
+    >>> unpack(pack([UUID(int=5), "x"], ensure_determinism=True, unsafe_fallback=False))
+    ['00000000-0000-0000-0000-000000000005', 'x']
+    """
+    key = tag.encode()
+    for other, (taken, _) in _EXTENSIONS.items():
+        if taken == key and other is not cls:
+            raise Exception(f"Type tag {tag!r} is already taken by {other}.")
+    if cls in _NATIVE or cls in _ENCODERS and cls not in _EXTENSIONS:
+        raise Exception(f"Cannot register a type that is handled natively: {cls}")
+    if encode is None or decode is None:
+        encode, decode = _STANDARD[cls] if cls in _STANDARD else _fieldwise(cls)
+    global _SCALARS, _SHAREABLE_SCALARS
+    if cls in _LEAVES:  # Walked nodes of this type are dispatched from now on.
+        _REGISTERED_LEAVES[cls] = _LEAVES.pop(cls)
+        del _SHAREABLE_LEAVES[cls]
+        _SCALARS, _SHAREABLE_SCALARS = _SCALARS - {cls}, _SHAREABLE_SCALARS - {cls}
+    _EXTENSIONS[cls] = key, encode
+    _EXTENSION_DECODERS[key] = decode
+    _ENCODERS[cls] = _enc_extension
+    _passthrough()
+
+
+def unregister_type(cls):
+    """
+    Undo 'register_type(cls, ...)': 'cls' is packed as before it, and its tag can no longer be unpacked.
+
+    >>> unregister_type(list)
+    Traceback (most recent call last):
+    ...
+    Exception: Type not registered: <class 'list'>
+    """
+    if cls not in _EXTENSIONS:
+        raise Exception(f"Type not registered: {cls}")
+    key, _ = _EXTENSIONS.pop(cls)
+    del _EXTENSION_DECODERS[key], _ENCODERS[cls]
+    global _SCALARS, _SHAREABLE_SCALARS
+    if cls in _REGISTERED_LEAVES:
+        _LEAVES[cls] = _SHAREABLE_LEAVES[cls] = _REGISTERED_LEAVES.pop(cls)
+        _SCALARS, _SHAREABLE_SCALARS = _SCALARS | {cls}, _SHAREABLE_SCALARS | {cls}
+    _passthrough()
+
+
+def _passthrough():
+    """
+    orjson options of the pure JSON attempt, for the types registered so far.
+
+    bson takes subclasses of its types as their base, e.g., NamedTuples as lists: registering one disables the BSON attempt.
+    """
+    global _PASSTHROUGH, _BSON_PROBE
+    _PASSTHROUGH = 0
+    _BSON_PROBE = not any(issubclass(cls, _BSON_TYPES) for cls in _EXTENSIONS)
+    if any(map(is_dataclass, _EXTENSIONS)):
+        _PASSTHROUGH |= orjson.OPT_PASSTHROUGH_DATACLASS
+    if not _EXTENSIONS.keys().isdisjoint({datetime, date, time}):
+        _PASSTHROUGH |= orjson.OPT_PASSTHROUGH_DATETIME
+
+
+_NATIVE = frozenset({str, int, float, bool, type(None), bytes})
+_BSON_TYPES = (str, int, float, bytes, datetime, list, tuple, dict, Mapping)
+
+
+def _zone(tz):
+    """Time zone as its IANA key, its fixed offset (in microseconds) or None."""
+    if tz is None:
+        return None
+    if isinstance(getattr(tz, "key", None), str) or isinstance(getattr(tz, "zone", None), str):  # zoneinfo, pytz
+        return getattr(tz, "key", None) or tz.zone
+    if isinstance(tz, timezone):
+        return tz.utcoffset(None) // _MICROSECOND
+    raise Exception(f"Cannot handle this time zone: {tz!r}")
+
+
+def _unzone(zone):
+    if zone is None:
+        return None
+    if isinstance(zone, str):
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo(zone)
+    return timezone(timedelta(microseconds=zone))
+
+
+def _enc_clock(obj):
+    """State of a datetime or time: wall clock, time zone (see '_zone()') and fold."""
+    return [obj.replace(tzinfo=None, fold=0).isoformat(), _zone(obj.tzinfo), obj.fold]
+
+
+_STANDARD = {
+    UUID: (lambda obj: obj.bytes, lambda state: UUID(bytes=bytes(state))),
+    datetime: (_enc_clock, lambda state: datetime.fromisoformat(state[0]).replace(tzinfo=_unzone(state[1]), fold=state[2])),
+    time: (_enc_clock, lambda state: time.fromisoformat(state[0]).replace(tzinfo=_unzone(state[1]), fold=state[2])),
+    date: (date.isoformat, date.fromisoformat),
+}
+
+
+def _fieldwise(cls):
+    """Default encoder and decoder of 'register_type()'."""
+    if issubclass(cls, tuple) and hasattr(cls, "_fields"):
+        return list, lambda state: cls(*state)
+    if is_dataclass(cls):
+        names = [f.name for f in fields(cls)]
+    elif all("__slots__" in vars(c) for c in cls.__mro__[:-1]):
+        slots = [[c.__slots__] if isinstance(c.__slots__, str) else c.__slots__ for c in reversed(cls.__mro__[:-1])]
+        names = [name for names in slots for name in names if name not in ("__dict__", "__weakref__")]
+    else:
+        msg = "only NamedTuples, dataclasses and '__slots__' classes have defaults."
+        raise Exception(f"Please provide 'encode' and 'decode' for {cls}: {msg}")
+
+    def decode(state):
+        obj = cls.__new__(cls)
+        for name, value in zip(names, state):
+            object.__setattr__(obj, name, value)  # Also for frozen dataclasses.
+        return obj
+
+    return lambda obj: [getattr(obj, name) for name in names], decode
+
+
+def _enc_extension(obj, ctx):
+    tag, encode = _EXTENSIONS[type(obj)]
+    return 0, _extension_blob(tag, _finish(*_walk(encode(obj), ctx), ctx), ctx), None
+
+
+def _extension_blob(tag, state, ctx):
+    if ctx.version == 2:
+        return _seq_blob(b"extn_", [tag, state], ctx)
+    return _indexed_blob(b"00extn_", [tag, state], ctx)
+
+
+def _extension_decoder(tag):
+    decode = _EXTENSION_DECODERS.get(bytes(tag))
+    if decode is None:
+        raise Exception(f"Unknown type tag {bytes(tag).decode()!r}. Please register it with 'register_type()'.")
+    return decode
+
+
+def _enc_set(obj, ctx):
+    """
+    Set or frozenset, with its elements sorted so that equal sets are packed alike.
+
+    Elements that cannot be compared are ordered by their encoding, as in '_sorted_dict()'.
+    >>> unpack(pack({1, "a", (2, "b"), b"x"}, ensure_determinism=True, unsafe_fallback=False)) == {1, "a", (2, "b"), b"x"}
+    True
+    """
+    try:
+        elements = sorted(obj)
+    except TypeError:
+        state = _seq_blob(b"list_", _sorted_blobs(obj, ctx), ctx)
+    else:
+        state = _finish(*_walk(elements, ctx), ctx)
+    return 0, _extension_blob(_EXTENSIONS[type(obj)][0], state, ctx), None
+
+
+def _sorted_blobs(elements, ctx):
+    """Blobs of 'elements', in the order of their encoding."""
+    if ctx.refs is None and ctx.out_of_band is None:  # Encoding has no side effect on 'ctx': its blobs are the sort keys.
+        return sorted((_finish(*_walk(e, ctx), ctx) for e in elements), key=_joined)
+    # The reference table and the buffer numbers must not depend on the iteration order of the set.
+    keyctx = Packing(ctx.ensure_determinism, ctx.unsafe_fallback, version=ctx.version, canonical=True)
+    ordered = sorted(elements, key=lambda e: _finish(*_walk(e, keyctx), keyctx))
+    return [_finish(*_walk(e, ctx), ctx) for e in ordered]
+
+
+def _joined(blob):
+    return blob if type(blob) is bytes else b"".join(blob.leaves())
+
+
+def _hashable(obj):
+    """
+    Set element as it was packed: pure tuples come back as lists (see '_enc_tuple()'), which cannot be set elements.
+
+    >>> unpack(pack([{(1, 2)}, frozenset({(1, "a")}), {1: {((3,), b"x")}}], True, False))
+    [{(1, 2)}, frozenset({(1, 'a')}), {1: {((3,), b'x')}}]
+    """
+    if type(obj) is list or type(obj) is tuple:
+        return tuple(map(_hashable, obj))
+    return obj
+
+
+for _args in [(set, "set", sorted, lambda state: set(map(_hashable, state))),
+              (frozenset, "frozenset", sorted, lambda state: frozenset(map(_hashable, state))),
+              (Decimal, "decimal", str, Decimal),
+              (timedelta, "timedelta", lambda td: [td.days, td.seconds, td.microseconds], lambda state: timedelta(*state)),
+              (complex, "complex", lambda c: [c.real, c.imag], lambda state: complex(*state))]:
+    register_type(*_args)
+# Sets sort their elements with the options of the call (see '_enc_set()'), which 'encode(obj)' cannot see.
+_ENCODERS[set] = _ENCODERS[frozenset] = _enc_set
+
+
+def _dec_prqs(blob, buffers):
+    import pandas as pd
+    from io import BytesIO
+
+    obj = pd.read_parquet(BytesIO(blob)).squeeze()
+    if obj.name == "_none_":
+        obj.rename(None, inplace=True)
+    return obj
+
+
+def _dec_bsos(blob, buffers):
+    from pandas import Series
+
+    dec = bson.decode(blob)
+    obj = deserialize_numpy(dec["v"], buffers)
+    kwargs = {"name": dec["n"]} if "n" in dec else {}
+    return Series(obj, dec["i"], **kwargs)
+
+
+def _dec_isrs(blob, buffers):
+    from pandas import Series
+
+    meta, values = indexed_children(blob)
+    dec = bson.decode(meta)
+    kwargs = {"name": dec["n"]} if "n" in dec else {}
+    return Series(deserialize_numpy(values, buffers), dec["i"], **kwargs)
+
+
+def _dec_prqd(blob, buffers):
+    import pandas as pd
+    from io import BytesIO
+
+    return pd.read_parquet(BytesIO(blob))
+
+
+def _dec_npdf(blob, buffers):
+    from pandas import DataFrame
+
+    return DataFrame(deserialize_numpy(blob, buffers))
+
+
+def _dec_colf(blob, buffers):
+    """Columnar frame: 'blob' may be a memoryview, so that numeric columns are read in place."""
+    return _dec_frame(indexed_children(memoryview(blob)), buffers, _dec_column)
+
+
+def _dec_frame(children, buffers, column):
+    import pandas as pd
+
+    meta = orjson.loads(bytes(children[0]))
+    rest = iter(children[1:])
+    index = _dec_index(meta["i"], rest, buffers, column)
+    if "s" in meta:
+        return pd.Series(_dec_values(meta.get("d"), rest, buffers, column), index, name=meta["s"], copy=False)
+    columns = _dec_index(meta["c"], rest, buffers, column)
+    dtypes = meta.get("d", {})
+    arrays = [_dec_values(dtypes.get(str(i)), rest, buffers, column) for i in range(len(columns))]
+    return pd.DataFrame._from_arrays(arrays, columns=columns, index=index, verify_integrity=False)
+
+
+def _dec_index(spec, rest, buffers, column):
+    import numpy as np
+    import pandas as pd
+
+    if "r" in spec:
+        return pd.RangeIndex(*spec["r"], name=spec["n"])
+    if "v" in spec:
+        labels = np.empty(len(spec["v"]), dtype=object)
+        labels[:] = spec["v"]
+        return pd.Index._simple_new(labels, name=spec["n"])  # Skip dtype inference, labels are known to be object.
+    if "m" in spec:
+        levels, codes = [], []
+        for level in spec["m"]:
+            levels.append(_dec_index(level, rest, buffers, column))
+            codes.append(column(next(rest), buffers))
+        return pd.MultiIndex(levels, codes, names=spec["n"], verify_integrity=False)
+    values = _dec_values(spec.get("d"), rest, buffers, column)
+    return pd.Index(values, dtype=values.dtype, copy=False, name=spec["n"])
+
+
+def _dec_values(spec, rest, buffers, column):
+    """Reverse '_enc_values()'."""
+    if spec is None:
+        return column(next(rest), buffers)
+    import pandas as pd
+
+    if "z" in spec:
+        return pd.DatetimeIndex(column(next(rest), buffers)).tz_localize("UTC").tz_convert(spec["z"]).array
+    codes = column(next(rest), buffers)
+    categories = _dec_index(spec["k"], rest, buffers, column)
+    return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories, spec["o"]))
+
+
+def _dec_column(blob, buffers):
+    if blob[:7] == b"00strs_":
+        return deserialize_strings(blob[7:])
+    if blob[:7] == b"00ndar_":
+        return _deserialize_numpy2(blob[7:], buffers)
+    return deserialize_numpy(blob[7:], buffers)
+
+
+def _dec_column2(blob, buffers):
+    if blob[0] == _TAGS[b"strs_"][0]:
+        return deserialize_strings(blob[1:])
+    return _deserialize_numpy2(blob[1:], buffers)
+
+
+def _dec_recb(blob, buffers):
+    return _rows(*_record_columns(indexed_children(memoryview(blob)), buffers, _dec_field))
+
+
+def _dec_field(blob, buffers):
+    if bytes(blob[:7]) in (b"00nmpy_", b"00ndar_", b"00strs_"):
+        return _dec_column(blob, buffers)
+    return traversal_dec(bytes(blob), buffers)
+
+
+def _record_columns(children, buffers, field):
+    """Keys and columns of a record batch, as ndarrays (int, float, bool and str columns) or lists."""
+    return orjson.loads(bytes(children[0])), [field(child, buffers) for child in children[1:]]
+
+
+def _rows(keys, columns):
+    columns = [c if type(c) is list else c.tolist() for c in columns]
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def _dec_refs(blob, buffers):
+    """Reference table: shared objects, each decoded once, then the root."""
+    children = indexed_children(blob)
+    shared = Shared(buffers or ())
+    for child in children[:-1]:
+        shared.objects.append(traversal_dec(bytes(child), shared))
+    return traversal_dec(bytes(children[-1]), shared)
+
+
+class Shared(list):
+    """Out-of-band buffers, plus the objects already decoded from a reference table ('dedup' packing)."""
+
+    __slots__ = ("objects",)
+
+    def __init__(self, buffers):
+        super().__init__(buffers)
+        self.objects = []
+
+
+def _dec_idct(blob, buffers):
+    children = indexed_children(blob)
+    return {bytes(children[i]).decode(): traversal_dec(bytes(children[i + 1]), buffers) for i in range(0, len(children), 2)}
+
+
+def _dec_idcB(blob, buffers):
+    children = indexed_children(blob)
+    items = [traversal_dec(bytes(child), buffers) for child in children]
+    return dict(zip(items[::2], items[1::2]))
+
+
+def _dec_dicB(blob, buffers):
+    decoded = bson.decode(blob).items()
+    return {traversal_dec(unhexlify(k.encode("utf-8")), buffers): traversal_dec(v, buffers) for k, v in decoded}
+
+
+def _dec_dicK(blob, buffers):
+    keys, values = (traversal_dec(bytes(child), buffers) for child in indexed_children(blob))
+    return dict(zip(keys if type(keys) is list else keys.tolist(), values))
+
+
+def _dec_extn(blob, buffers):
+    tag, state = indexed_children(blob)
+    return _extension_decoder(tag)(traversal_dec(bytes(state), buffers))
+
+
+_DECODERS = {
+    b"json_": lambda blob, buffers: orjson.loads(blob),
+    b"bson_": lambda blob, buffers: bson.decode(blob)["_"],
+    b"bint_": lambda blob, buffers: int(blob.decode()),
+    b"nmpy_": lambda blob, buffers: deserialize_numpy(blob, buffers),
+    b"ndar_": lambda blob, buffers: _deserialize_numpy2(blob, buffers),
+    b"npsc_": lambda blob, buffers: _deserialize_numpy2(blob, buffers)[()],
+    b"prqs_": _dec_prqs,
+    b"bsos_": _dec_bsos,
+    b"isrs_": _dec_isrs,
+    b"prqd_": _dec_prqd,
+    b"npdf_": _dec_npdf,
+    b"colf_": _dec_colf,
+    b"strs_": lambda blob, buffers: deserialize_strings(blob),
+    b"list_": lambda blob, buffers: [traversal_dec(child, buffers) for child in bson.decode(blob)["_"]],
+    b"tupl_": lambda blob, buffers: tuple(traversal_dec(child, buffers) for child in bson.decode(blob)["_"]),
+    b"dict_": lambda blob, buffers: {k: traversal_dec(child, buffers) for k, child in bson.decode(blob).items()},
+    b"dicB_": _dec_dicB,
+    b"dicK_": _dec_dicK,
+    b"recb_": _dec_recb,
+    b"extn_": _dec_extn,
+    b"ilst_": lambda blob, buffers: [traversal_dec(bytes(child), buffers) for child in indexed_children(blob)],
+    b"itpl_": lambda blob, buffers: tuple(traversal_dec(bytes(child), buffers) for child in indexed_children(blob)),
+    b"idct_": _dec_idct,
+    b"idcB_": _dec_idcB,
+    b"refs_": _dec_refs,
+    b"dref_": lambda blob, buffers: buffers.objects[int.from_bytes(blob, byteorder="little")],
+}
+
+
+def traversal_dec(dump, buffers=None):
     if isinstance(dump, bytes):
         header = dump[2:7]
-        blob = dump[7:]
-        if header == b"json_":
-            return orjson.loads(blob)
-        if header == b"bson_":
-            return bson.decode(blob)["_"]
-        if header == b"bint_":
-            return int(blob.decode())
-        if header == b"nmpy_":
-            return deserialize_numpy(blob)
-        if header == b"prqs_":
-            import pandas as pd
-            from io import BytesIO
-
-            obj = pd.read_parquet(BytesIO(blob)).squeeze()
-            if obj.name == "_none_":
-                obj.rename(None, inplace=True)
-            return obj
-        if header == b"bsos_":
-            from pandas import Series
-
-            dec = bson.decode(blob)
-            obj = deserialize_numpy(dec["v"])
-            kwargs = {"name": dec["n"]} if "n" in dec else {}
-            return Series(obj, dec["i"], **kwargs)
-        if header == b"prqd_":
-            import pandas as pd
-            from io import BytesIO
-
-            return pd.read_parquet(BytesIO(blob))
-        if header == b"npdf_":
-            from pandas import DataFrame
-
-            return DataFrame(deserialize_numpy(blob))
-        if header == b"list_":
-            return traversal_dec(bson.decode(blob)["_"])
-        if header == b"tupl_":
-            return traversal_dec(tuple(bson.decode(blob)["_"]))
-        if header == b"dict_":
-            return traversal_dec(bson.decode(blob))
-        if header == b"dicB_":
-            decoded = bson.decode(blob).items()
-            return {traversal_dec(unhexlify(k.encode("utf-8"))): traversal_dec(v) for k, v in decoded}
+        decoder = _DECODERS.get(header)
+        if decoder is not None:
+            if instrument.ACTIVE is not None:
+                return _traced_dec(decoder, header, dump[7:], buffers)
+            return decoder(dump[7:], buffers)
         if header in [b"pckl_", b"dill_"]:
+            if instrument.ACTIVE is not None:
+                return _traced_dec(lambda blob, buffers: frompickle(dump), header, dump[7:], buffers)
             return frompickle(dump)
         return dump
     # if isinstance(dump, (int, str, bool)):
     #     return dump
     if isinstance(dump, tuple):
-        return tuple(traversal_dec(d) for d in dump)
+        return tuple(traversal_dec(d, buffers) for d in dump)
     if isinstance(dump, list):
-        return [traversal_dec(d) for d in dump]
+        return [traversal_dec(d, buffers) for d in dump]
     if isinstance(dump, dict):
-        return {k: traversal_dec(v) for k, v in dump.items()}
+        return {k: traversal_dec(v, buffers) for k, v in dump.items()}
     raise Exception(f"Cannot unpack {type(dump)}.")  # pragma: no cover
 
 
-def pack(obj, ensure_determinism, unsafe_fallback, compressed=True):
+def _traced_dec(decoder, header, blob, buffers):
+    start = perf_counter()
+    obj = decoder(blob, buffers)
+    instrument.ACTIVE.record("decode", header.decode(), len(blob), 0, perf_counter() - start)
+    return obj
+
+
+def decode2(blob, buffers=None):
+    """Decode a version 2 node: one-byte tag and body. 'blob' is preferably a memoryview, so that children are not copied."""
+    decoder = _DECODERS2[blob[0]]
+    if instrument.ACTIVE is not None:
+        return _traced_dec(decoder, _NAMES[blob[0] - 1], blob[1:], buffers)
+    return decoder(blob[1:], buffers)
+
+
+def _dec_bsos2(blob, buffers):
+    from pandas import Series
+
+    size, pos = _read_varint(blob, 0)
+    meta = bson.decode(blob[pos : pos + size])
+    kwargs = {"name": meta["n"]} if "n" in meta else {}
+    return Series(_deserialize_numpy2(blob[pos + size :], buffers), meta["i"], **kwargs)
+
+
+def _dec_dict2(blob, buffers):
+    children = frames(blob)
+    return {str(children[i], "utf-8"): decode2(children[i + 1], buffers) for i in range(0, len(children), 2)}
+
+
+def _dec_dicB2(blob, buffers):
+    children = frames(blob)
+    return {decode2(children[i], buffers): decode2(children[i + 1], buffers) for i in range(0, len(children), 2)}
+
+
+def _dec_dicK2(blob, buffers):
+    keys, values = (decode2(child, buffers) for child in frames(blob))
+    return dict(zip(keys if type(keys) is list else keys.tolist(), values))
+
+
+def _dec_extn2(blob, buffers):
+    tag, state = frames(blob)
+    return _extension_decoder(tag)(decode2(state, buffers))
+
+
+def _dec_field2(blob, buffers):
+    if blob[0] in (_TAGS[b"nmpy_"][0], _TAGS[b"strs_"][0]):
+        return _dec_column2(blob, buffers)
+    return decode2(blob, buffers)
+
+
+def _dec_refs2(blob, buffers):
+    children = frames(blob)
+    shared = Shared(buffers or ())
+    for child in children[:-1]:
+        shared.objects.append(decode2(child, shared))
+    return decode2(children[-1], shared)
+
+
+def _dec_dill(blob, buffers):  # pragma: no cover
+    import dill
+
+    return dill.loads(blob)
+
+
+_DECODERS2 = {
+    b"json_": lambda blob, buffers: orjson.loads(blob),
+    b"bson_": lambda blob, buffers: bson.decode(blob)["_"],
+    b"bint_": lambda blob, buffers: int.from_bytes(blob, byteorder="little", signed=True),
+    b"nmpy_": lambda blob, buffers: _deserialize_numpy2(blob, buffers),
+    b"bsos_": _dec_bsos2,
+    b"prqs_": _dec_prqs,
+    b"prqd_": _dec_prqd,
+    b"colf_": lambda blob, buffers: _dec_frame(frames(blob), buffers, _dec_column2),
+    b"strs_": lambda blob, buffers: deserialize_strings(blob),
+    b"list_": lambda blob, buffers: [decode2(child, buffers) for child in frames(blob)],
+    b"tupl_": lambda blob, buffers: tuple(decode2(child, buffers) for child in frames(blob)),
+    b"dict_": _dec_dict2,
+    b"dicB_": _dec_dicB2,
+    b"dicK_": _dec_dicK2,
+    b"recb_": lambda blob, buffers: _rows(*_record_columns(frames(blob), buffers, _dec_field2)),
+    b"extn_": _dec_extn2,
+    b"refs_": _dec_refs2,
+    b"dref_": lambda blob, buffers: buffers.objects[_read_varint(blob, 0)[0]],
+    b"pckl_": lambda blob, buffers: pickle.loads(blob),
+    b"dill_": _dec_dill,
+    b"byts_": lambda blob, buffers: bytes(blob),
+    b"npsc_": lambda blob, buffers: _deserialize_numpy2(blob, buffers)[()],
+}
+_DECODERS2 = {_TAGS[name][0]: decoder for name, decoder in _DECODERS2.items()}
+
+
+def pack(obj, ensure_determinism, unsafe_fallback, compressed=True, buffer_callback=None, indexed=False, dedup=False,
+         cache=None, version=1, canonical=False, records=False):
     r"""
     Serialize 'obj' to bytes.
 
+    'compressed' is False, True (lz4), a codec name ("lz4", "lz4hc", "zlib", "lzma"),
+    "auto" (skip compression when the blob is small or does not shrink), "auto-small" or an 'Adaptive' policy;
+    see 'compressors.compress()'.
+
+    When 'buffer_callback' is given, ndarray (and numeric Series/DataFrame) memory is handed to it as
+    flat 'memoryview's instead of being copied into the blob. The same buffers, in the same order,
+    should be given to 'unpack()'. Only the remaining metadata blob is compressed.
+
+    'indexed=True' frames containers with an offset table, allowing 'lazy_unpack()' to decode children on demand.
+
+    'dedup=True' writes objects appearing several times (by identity) only once, see 'Packing';
+    'unpack()' gives them back as a single shared object. 'dedup="content"' also merges equal bytes/ndarrays.
+
+    'cache' is an optional 'PackCache', which keeps the encoded ndarrays, Series and DataFrames between calls.
+
+    'version=2' writes the compact format: one-byte tags, varint framing and binary ndarray descriptors,
+    which mostly pays off for many small messages. 'unpack()' reads both versions.
+
+    'canonical=True' gives the same bytes for equal objects, e.g., dicts built in different orders, see 'Packing'.
+    To fingerprint an object, 'digest()' hashes this same encoding without building the blob.
+
+    Lists of (at least 16) dicts sharing the same str keys are written as record batches: keys once, then one column per key,
+    numeric ones as ndarrays.
+    'records=True' also applies it to pure JSON payloads, which orjson would otherwise dump as they are:
+    more compact, and readable as columns by 'unpack_records()', but slower to pack.
+
     Attempt to serialize using one of the following options, in this order:
         orjson
         bson
         bigints as str
-        numpy ndarray as raw bytes
-        pandas numeric Series/DataFrame as ndarray raw bytes
+        registered types (see 'register_type()') as their state, e.g., set, Decimal, NamedTuples, dataclasses
+        numpy ndarray as raw bytes, in their own memory order (structured dtypes included), numpy scalars likewise
+        pandas Series/DataFrame with numeric/str/datetime/categorical columns column by column, keeping index and columns
         pandas ill-behaved Series/DataFrame as parquet
         pickle when 'unsafe_fallback=True'
         dill when 'ensure_determinism=False'.
@@ -294,17 +1645,73 @@ def pack(obj, ensure_determinism, unsafe_fallback, compressed=True):
     {'0': 3, 'b': <built-in function print>}
     >>> unpack(pack({"0": 3, "b": b"b"}, ensure_determinism=True, unsafe_fallback=False, compressed=False))
     {'0': 3, 'b': b'b'}
-    """
-    dump = traversal_enc(obj, ensure_determinism, unsafe_fallback)
-    if compressed:
-        import lz4.frame as lz4
+    >>> pack(True, ensure_determinism=True, unsafe_fallback=False, compressed="auto")
+    b'00json_true'
+    >>> unpack(pack(d, ensure_determinism=True, unsafe_fallback=False, compressed="lzma"))[1]
+    [b'asd', 5]
+
+    Out-of-band buffers.
+    >>> buffers = []
+    >>> a = np.arange(6, dtype=np.int16).reshape(2, 3)
+    >>> obj = {"a": a, "t": a.T, "s": pd.Series([1.5, 2.5])}
+    >>> blob = pack(obj, ensure_determinism=True, unsafe_fallback=False, buffer_callback=buffers.append)
+    >>> for b in buffers:
+    ...     bytes(b)
+    b'\x00\x00\x01\x00\x02\x00\x03\x00\x04\x00\x05\x00'
+    b'\x00\x00\x01\x00\x02\x00\x03\x00\x04\x00\x05\x00'
+    b'\x00\x00\x00\x00\x00\x00\xf8?\x00\x00\x00\x00\x00\x00\x04@'
+    >>> obj = unpack(blob, buffers=buffers)
+    >>> obj["t"]
+    array([[0, 3],
+           [1, 4],
+           [2, 5]], dtype=int16)
+    >>> np.shares_memory(obj["a"], a), np.shares_memory(obj["t"], a)
+    (True, True)
+    >>> obj["s"]
+    0    1.5
+    1    2.5
+    dtype: float64
+
+    Deduplication.
+    >>> vocab = np.arange(1000)
+    >>> records = [{"id": i, "vocab": vocab} for i in range(10)]
+    >>> len(pack(records, ensure_determinism=True, unsafe_fallback=False, compressed=False))
+    80760
+    >>> len(pack(records, ensure_determinism=True, unsafe_fallback=False, compressed=False, dedup=True))
+    8954
+    >>> obj = unpack(pack(records, ensure_determinism=True, unsafe_fallback=False, dedup=True))
+    >>> obj[0]["vocab"] is obj[9]["vocab"], obj[9]["id"]
+    (True, 9)
+    >>> obj = unpack(pack([vocab, vocab.copy()], ensure_determinism=True, unsafe_fallback=False, dedup="content"))
+    >>> obj[0] is obj[1]
+    True
 
-        return b"00lz4__" + lz4.compress(dump)
-    return dump
+    Compact format.
+    >>> msg = {"id": 7, "tags": (1, "x"), "raw": b"abc", "x": np.arange(3, dtype=np.int8)}
+    >>> len(pack(msg, ensure_determinism=True, unsafe_fallback=False, compressed=False))
+    142
+    >>> blob = pack(msg, ensure_determinism=True, unsafe_fallback=False, compressed=False, version=2)
+    >>> blob[:7], len(blob)
+    (b'00v2___', 54)
+    >>> unpack(blob)
+    {'id': 7, 'tags': (1, 'x'), 'raw': b'abc', 'x': array([0, 1, 2], dtype=int8)}
+
+    Numpy scalars and structured arrays.
+    >>> unpack(pack([np.float32(1.5), np.datetime64("2020-01-02")], ensure_determinism=True, unsafe_fallback=False))
+    [1.5, numpy.datetime64('2020-01-02')]
+    >>> unpack(pack(np.array([(1, 2.5)], dtype=[("a", "i2"), ("b", "f4")]), ensure_determinism=True, unsafe_fallback=False))
+    array([(1, 2.5)], dtype=[('a', '<i2'), ('b', '<f4')])
+    """
+    args = buffer_callback, indexed, dedup, cache, version, canonical, records
+    dump = traversal_enc(obj, ensure_determinism, unsafe_fallback, *args)
+    return compress(dump, compressed)
 
 
-def unpack(blob):
+def unpack(blob, buffers=None):
     """
+    Deserialize bytes produced by 'pack()'.
+
+    'buffers' are the ones collected by the 'buffer_callback' given to 'pack()', if any.
     >>> from pandas import DataFrame as DF
     >>> df = DF({"a": ["5", "6", "7"], "b": [1, 2, 3]}, index=["x", "y", "z"])
     >>> complex_data = {"a": b"Some binary content", ("mixed-types tuple as a key", 4): 123, "df": df}
@@ -315,69 +1722,453 @@ def unpack(blob):
     z  7  3}
     >>> dump = pack(complex_data, ensure_determinism=False, unsafe_fallback=False)
     >>> dump
-    b'00lz4__\\x04"M\\x18h@h\\x0b\\x00\\x00\\x00\\x00\\x00\\x00\\x94\\x95\\x06\\x00\\x00\\xf1*00dicB_a\\x0b\\x00\\x00\\x0530306a736f6e5f226122\\x00\\x13\\x00\\x00\\x00\\x00Some binary content.\\x00\\xd27475706c5f480\\x01\\x00b45f004\\x0c\\x00\\x8000530002\\x05\\x00\\x01\\x02\\x00\\rb\\x00\\xf5\\x07d697865642d74797065732X\\x00`652061\\x12\\x00\\xf4\\x0461206b6579220531000r\\x00\\x0bV\\x00\\x113}\\x00 \\x00\\n\\xb8\\x00\\xa100json_123\\xaf\\x00\\t\\xdd\\x00p46622\\x00b(\\x00\\xf0\\x1100prqd_PAR1\\x15\\x04\\x15\\x1e\\x15"L\\x15\\x06\\x15\\x00\\x12\\x00\\x00\\x0f8\\x01\\x00\\x00\\x005\\x05\\x00\\x106\\x05\\x00\\xf667\\x15\\x00\\x15\\x14\\x15\\x18,\\x15\\x06\\x15\\x10\\x15\\x06\\x15\\x06\\x1c6\\x00(\\x017\\x18\\x015\\x00\\x00\\x00\\n$\\x02\\x00\\x00\\x00\\x06\\x01\\x02\\x03$\\x00&\\x94\\x01\\x1c\\x15\\x0c\\x195\\x10\\x00\\x06\\x19\\x18\\x01a\\x15\\x02\\x16\\x06\\x16\\x84\\x01\\x16\\x8c\\x01&F&\\x085\\x00\\xe0\\x19,\\x15\\x04\\x15\\x00\\x15\\x02\\x00\\x15\\x00\\x15\\x10\\x15?\\x00d\\x15\\x04\\x150\\x15.\\x7f\\x00p\\x18\\x04\\x01\\x00\\t\\x01<\\x19\\x00\\x00\\x02\\x00\\x10\\x03\\x05\\x00 \\x00\\x00.\\x00\\t\\x85\\x00$\\x18\\x08\\x1a\\x00 \\x18\\x08\\xa6\\x00\\x00\\x02\\x00?\\x16\\x00(\\x16\\x00\\x00\\x0c\\xa7\\x00T\\xe2\\x03\\x1c\\x15\\x04\\xa7\\x00\\x11b\\xa7\\x00\\xbf\\xda\\x01\\x16\\xdc\\x01&\\xd0\\x02&\\x86\\x02Y\\x00\\x19\\x0f\\xcb\\x00\\x02\\rJ\\x01\\x10x\\x9f\\x00\\x10y\\x05\\x00\\x1fzJ\\x01\\x01Lz\\x18\\x01x\\xa3\\x00&\\xa8\\x06J\\x01\\xf1\\x03\\x11__index_level_0__\\xb3\\x00\\x02Z\\x01Q\\xda\\x05&\\x9c\\x05\\x91\\x01\\x01G\\x00\\x0f\\x91\\x00\\x01\\xf0\\x0b\\x19L5\\x00\\x18\\x06schema\\x15\\x06\\x00\\x15\\x0c%\\x02\\x18\\x01a%\\x00L\\x1cV\\x01\\x10\\x04\\x0e\\x00\\x12b\\x16\\x00\\x0ej\\x00\\x03&\\x00o\\x16\\x06\\x19\\x1c\\x19<\\xe0\\x01&\\x0fr\\x01J\\x0f,\\x018\\xb0\\x16\\xe2\\x03\\x16\\x06&\\x08\\x16\\xf4\\x03\\x14\\xdc\\x01\\xd2\\x18\\x06pandas\\x18\\xd5\\x04{"\\x83\\x01\\xcdcolumns": ["\\x97\\x01R"], ""\\x00\\x02\\xb2\\x01\\x11e)\\x00\\xfa\\x07{"name": null, "field_\\x14\\x00\\x02i\\x00@_typ)\\x00\\xf5\\x02"unicode", "numpy\\x19\\x00`object\\x18\\x00\\xf6\\x12metadata": {"encoding": "UTF-8"}}\\x8d\\x00\\n\\x86\\x00 "a?\\x00\\t\\x85\\x00\\x02\\x13\\x00\\x0f\\x84\\x00*\\x00\\xdc\\x005}, \\xec\\x00."bf\\x00\\x01\\x13\\x00\\x0bf\\x00Pint64+\\x00\\n\\xe8\\x00\\x05\\x17\\x00\\x07\\xe7\\x00\\x0cc\\x00\\x00\\x10\\x00\\x0cO\\x01\\x0f\\x95\\x01\\x00\\x0et\\x00\\x0f^\\x01\\x1b\\x00g\\x00\\x02M\\x01areatorq\\x01plibraryp\\x01ppyarrow\\xc4\\x00pversion\\x16\\x00\\x8611.0.0"}~\\x00\\x08\\x1d\\x00\\xf2\\x00.5.3"}\\x00\\x18\\x0cARROW:\\x9c\\x03@\\x18\\x98\\t/\\x01\\x00\\x822gDAAAQA\\x01\\x00\\xf1\\x00KAA4ABgAFAAgACg\\x15\\x00)BB \\x00\\x10w\\x15\\x00\\x15E \\x002IwC\\x10\\x00\\x04F\\x00\\x01 \\x00\\x10I\\x08\\x00\\x11B\\x08\\x00\\x01E\\x00\\x10I \\x00\\x10E\\x05\\x00\\xf4GAYAAABwYW5kYXMAAFUCAAB7ImluZGV4X2NvbHVtbnMiOiBbIl9faW5kZXhfbGV2ZWxfMF9fIl0sICJjb2x1bW5$\\x00\\xf0\\x01lcyI6IFt7Im5hbWUD\\x00\\xf0\\x11udWxsLCAiZmllbGRfbmFtZSI6IG51bGwH\\x00\\x03\\x90\\x00aNfdHlw\\x1c\\x00\\xf0\\x0eCJ1bmljb2RlIiwgIm51bXB5X3R5cGX\\x00\\xa2Aib2JqZWN0 \\x00\\xf0\\x0c1ldGFkYXRhIjogeyJlbmNvZGluZ\\x94\\x00\\xe0CJVVEYtOCJ9fV0t\\x00\\x04\\xbc\\x00\\x10z0\\x00EW3si\\x98\\x002CJhT\\x00\\x84ZpZWxkX2\\xcc\\x00PAiYSI<\\x00\\x0f\\xb0\\x00>\\xa9bnVsbH0sIH\\x88\\x00\\x1fi\\x88\\x00\\x06\\x1fi\\x88\\x00\\x06qpbnQ2NC \\x00\\xd0udW1weV90eXBl\\xe8\\x00\\x00\\xe8\\x01?dDY4\\x01\\x02\\x0f\\x84\\x00\\x02\\x06\\xa4\\x01\\xc2maWVsZF9uYW1L\\x00\\x0f\\x1c\\x02\\x05\\x00\\xb0\\x01\\x97nBhbmRhc1|\\x00PnVuaW\\x94\\x01 Ui\\x10\\x02xbnVtcHl\\xf4\\x01\\x82vYmplY3Q \\x00\\xa5WV0YWRhdGEH\\x02\\x04\\xbc\\x01\\x80cmVhdG9y\\xd4\\x00\\xc0eyJsaWJyYXJ5\\x10\\x00\\xb1InB5YXJyb3cH\\x00\\xf9\\x0bdmVyc2lvbiI6ICIxMS4wLjAifS\\xa8\\x00\\x912ZXJzaW9uD\\x00\\xa0jEuNS4zIn06\\x03\\x00\\xa4\\x03!Ah\\n\\x00\\x01`\\x03\\x01K\\x03PmP///\\x0f\\x00!QU\\xc0\\x03\\x10J \\x00\\x05\\xcb\\x030AAE\\x16\\x00\\x1fF$\\x01\\x03\\x00 \\x00\\x01@\\x00`8z///8\\xc3\\x03\\x11CU\\x00\\x10BQ\\x00\\x11A\\x0b\\x00\\x02\\x02\\x00\\x00\\x0b\\x00 Bi\\x0c\\x00@CAAM\\xd0\\x03"Bw\\xd0\\x03\\x01\\x02\\x00\\x11U\\x06\\x00\\xc2QABQACAAGAAc\\xad\\x00\\x12B:\\x00\\x01\\x02\\x00\\x03\\xa0\\x00\\x12G\\r\\x00\\x01\\x06\\x00\\x01\\x02\\x00\\x00\\xa0\\x00\\x10G`\\x00\\x00p\\x001QAB\\x15\\x00\\xf1\\x02==\\x00\\x18 parquet-cpp-\\xf1\\x04\\x13 \\xd1\\x04\\x12 \\xeb\\x04R\\x19<\\x1c\\x00\\x00\\x03\\x00\\xa0\\x00t\\x08\\x00\\x00PAR1\\x00\\x00\\x00\\x00\\x00'
+    b'00lz4__\\x04"M\\x18h@\\xc1\\x01\\x00\\x00\\x00\\x00\\x00\\x00^E\\x01\\x00\\x00\\x9a00dicK_\\x02\\x00\\x01\\x00\\x13\\x90\\x0f\\x00"\\x9a\\x01\\t\\x00\\xf0\\x0700list_\\x89\\x00\\x00\\x00\\x04_\\x00\\x81\\x00\\x00\\x00\\x050\\x00\\n\\x1c\\x00\\xe200json_"a"\\x051\\x00O\\x12\\x00btupl_H,\\x00\\x12@,\\x00\\x12#\\x1a\\x00\\x02,\\x00\\xc0mixed-types ,\\x00\\xa0e as a keyE\\x00\\x17\\x08+\\x00w4\\x00\\x00\\x052\\x00\\x0b\\x12\\x00@"df"v\\x00\\x01\\x90\\x00!\\x03\\x01\\x90\\x00\\x12\\xfbd\\x00\\x10\\x13\\'\\x00\\xf9\\x06Some binary content\\x051\\xab\\x00p123\\x052\\x00\\xc1-\\x00\\x8000colf_\\x03\\x0c\\x00\\x07\\x02\\x00\\x13?\\x0c\\x00\\x13a\\x08\\x00\\x13\\x92\\x08\\x00\\xf5\\x15{"i":{"v":["x","y","z"],"n":null},"c!\\x00Xa","b\\x1d\\x00u}00strsn\\x00D\\x01\\x00\\x01\\x02z\\x00\\xf0\\r\\x01\\x01\\x01\\x0156700nmpy_16\\xc2\\xa71\\xc2\\xa7int64\\xc2\\xa7$\\x00\\x03\\x87\\x01\\x14\\x00\\xa8\\x01\\xa0\\x03\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00'
     >>> unpack(dump)
     {'a': b'Some binary content', ('mixed-types tuple as a key', 4): 123, 'df':    a  b
     x  5  1
     y  6  2
     z  7  3}
+
+    Only the root of a dump is checked for the version 2 header, bytes starting like it are left alone.
+    >>> import numpy as np
+    >>> obj = {"k": MAGIC + b"\\x05hello", "a": np.arange(2)}
+    >>> unpack(pack(obj, ensure_determinism=True, unsafe_fallback=False))
+    {'k': b'00v2___\\x05hello', 'a': array([0, 1])}
+    >>> unpack(pack(b"\\xff\\x02\\x01\\x00", ensure_determinism=True, unsafe_fallback=False, compressed=False))
+    b'\\xff\\x02\\x01\\x00'
+    """
+    blob = decompress(blob)
+    if buffers is not None and not isinstance(buffers, (list, tuple)):
+        buffers = list(buffers)
+    return _decode(blob, buffers)
+
+
+def _decode(dump, buffers=None):
+    """Decode a whole uncompressed dump, of either format version."""
+    if dump[:7] == MAGIC:
+        # Small blobs are cheaper to slice by copying; large ones are viewed, so that arrays are not copied.
+        return decode2(dump[7:] if len(dump) < 65536 else memoryview(dump)[7:], buffers)
+    if dump[:7] == b"00dlta_":
+        raise Exception("Cannot unpack a delta blob alone: rebuild the full blob with 'apply_delta(base_blob, delta_blob)'.")
+    return traversal_dec(dump, buffers)
+
+
+def unpack_records(blob, buffers=None, to="columns"):
+    """
+    Deserialize a list of dicts packed as a record batch (see '_records_blob()') as columns instead of rows.
+
+    'to="columns"' gives a dict of columns: ndarrays for int, float, bool and str fields, lists otherwise.
+    'to="frame"' gives a pandas DataFrame with one column per key.
+    Other blobs (e.g., lists of less than 16 dicts or dicts not sharing the same keys) raise an exception.
+
+    >>> rows = [{"x": i, "y": str(i)} for i in range(100)]
+    >>> blob = pack(rows, ensure_determinism=True, unsafe_fallback=False, records=True)
+    >>> columns = unpack_records(blob)
+    >>> columns["x"][:3], columns["y"][-1]
+    (array([0, 1, 2]), '99')
+    >>> unpack_records(pack(rows, ensure_determinism=True, unsafe_fallback=False, records=True, version=2), to="frame").tail(2)
+         x   y
+    98  98  98
+    99  99  99
     """
-    if blob[:7] == b"00lz4__":
-        import lz4.frame as lz4
+    if to not in ("columns", "frame"):
+        raise Exception(f"Unknown record batch output: {to!r}")
+    blob = decompress(blob)
+    if buffers is not None and not isinstance(buffers, (list, tuple)):
+        buffers = list(buffers)
+    view = memoryview(blob)
+    if view[:7] == MAGIC and view[7] == _TAGS[b"recb_"][0]:
+        keys, columns = _record_columns(frames(view[8:]), buffers, _dec_field2)
+    elif view[:7] == b"00recb_":
+        keys, columns = _record_columns(indexed_children(view[7:]), buffers, _dec_field)
+    else:
+        raise Exception("Not a record batch.")
+    if to == "columns":
+        return dict(zip(keys, columns))
+    import pandas as pd
 
-        blob = lz4.decompress(blob[7:])
-    return traversal_dec(blob)
+    return pd.DataFrame(dict(zip(keys, columns)), copy=False)
 
 
 class NondeterminismException(Exception):
     pass
 
 
-def serialize_numpy(obj, ensure_determinism, unsafe_fallback, prefix=b"00nmpy_"):
+def serialize_numpy(obj, ensure_determinism, unsafe_fallback, prefix=b"00nmpy_", buffer_callback=None, chunked=False,
+                    version=1):
     """
+    Raw bytes preceded by a textual header with dims, dtype and shape.
+
+    'version=2' makes the header binary, see '_numpy_head()'. In version 1, arrays that the textual header cannot describe
+    (structured dtypes, dimensions from 2**32 on) or would force a copy (Fortran order) get the binary header under 'ndar_'.
+
+    When given, 'buffer_callback' receives a flat 'memoryview' of the array memory and returns its index;
+    only the header and that index are kept in the blob. C- and F-contiguous arrays are not copied.
+    'chunked=True' returns the in-band blob as 'Chunks' pointing to the array memory (C order).
     >>> from pandas import Series as S, DataFrame as DF, Series as S
     >>> df = DF({"a": ["5","6","7"], "b": ["1","2","3"]}, index=["x","y","z"]).to_numpy()
     >>> serialize_numpy(df, ensure_determinism=True, unsafe_fallback=True)
     b'05pckl_\\x80\\x05\\x95\\xa3\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x8c\\x15numpy.core.multiarray\\x94\\x8c\\x0c_reconstruct\\x94\\x93\\x94\\x8c\\x05numpy\\x94\\x8c\\x07ndarray\\x94\\x93\\x94K\\x00\\x85\\x94C\\x01b\\x94\\x87\\x94R\\x94(K\\x01K\\x03K\\x02\\x86\\x94h\\x03\\x8c\\x05dtype\\x94\\x93\\x94\\x8c\\x02O8\\x94\\x89\\x88\\x87\\x94R\\x94(K\\x03\\x8c\\x01|\\x94NNNJ\\xff\\xff\\xff\\xffJ\\xff\\xff\\xff\\xffK?t\\x94b\\x88]\\x94(\\x8c\\x015\\x94\\x8c\\x011\\x94\\x8c\\x016\\x94\\x8c\\x012\\x94\\x8c\\x017\\x94\\x8c\\x013\\x94et\\x94b.'
     """
+    if instrument.ACTIVE is None:
+        return _serialize_numpy(obj, ensure_determinism, unsafe_fallback, prefix, buffer_callback, chunked, version)
+    start = perf_counter()
+    blob = _serialize_numpy(obj, ensure_determinism, unsafe_fallback, prefix, buffer_callback, chunked, version)
+    dtype, nbytes = str(getattr(obj, "dtype", "?")), getattr(obj, "nbytes", 0)
+    instrument.ACTIVE.record("numpy", dtype, nbytes, _nbytes(blob), perf_counter() - start)
+    return blob
+
+
+def _serialize_numpy(obj, ensure_determinism, unsafe_fallback, prefix, buffer_callback, chunked, version):
     import numpy as np
 
     if isinstance(obj, np.ndarray):
-        if obj.dtype in [np.dtype(object)]:
+        if obj.dtype.hasobject:
             if unsafe_fallback:
-                return topickle(obj, ensure_determinism)
+                blob = topickle(obj, ensure_determinism)
+                return blob if version == 1 else _TAGS[blob[2:7]] + memoryview(blob)[7:]
             raise Exception(f"Please enable 'unsafe_fallback' or handle numpy types." f"Cannot handle this ndarray dtype: '{obj.dtype}'")
+        if version == 2:
+            return _serialize_numpy2(obj, prefix, buffer_callback, chunked)
+        if prefix == b"00nmpy_" and _needs_descriptor(obj):
+            return _serialize_numpy2(obj, b"00ndar_", buffer_callback, chunked)
         dims = str(len(obj.shape))
         dtype = str(obj.dtype)
         rest_of_header = f"§{dims}§{dtype}§".encode() + integers2bytes(obj.shape)
         rest_of_header_len = str(len(rest_of_header)).encode()
         header = rest_of_header_len + rest_of_header
+        if buffer_callback is not None:
+            fortran, flat = _flat(obj)
+            index = buffer_callback(memoryview(flat.reshape(-1).view(np.uint8)))
+            return prefix + b"00oob__" + index.to_bytes(8, byteorder="little") + (b"F" if fortran else b"C") + header
+        if chunked:
+            return Chunks([prefix + header, memoryview(np.ascontiguousarray(obj).reshape(-1).view(np.uint8))])
         # return header + lz4.compress(ascontiguousarray(obj).data)
-        return prefix + header + obj.data.tobytes()
+        return prefix + header + obj.tobytes()
     if unsafe_fallback:  # pragma: no cover
         return topickle(obj, ensure_determinism)
     raise Exception(f"Please enable 'unsafe_fallback'. Cannot handle this type '{type(obj)}'.")  # pragma: no cover
 
 
-def deserialize_numpy(blob):
+def _serialize_numpy2(obj, prefix, buffer_callback, chunked):
+    """Binary descriptor, then the data in C or Fortran order, whichever the array has (or a C copy of a strided one)."""
+    import numpy as np
+
+    fortran, flat = _flat(obj)
+    flags = _FORTRAN if fortran else 0
+    if buffer_callback is not None:
+        index = buffer_callback(memoryview(flat.reshape(-1).view(np.uint8)))
+        return prefix + _numpy_head(obj, flags | _OUT_OF_BAND) + _varint(index)
+    head = prefix + _numpy_head(obj, flags)
+    if chunked:
+        return Chunks([head, memoryview(flat.reshape(-1).view(np.uint8))])
+    return head + flat.tobytes()
+
+
+_OUT_OF_BAND, _FORTRAN, _STRUCTURED = 1, 2, 4
+
+
+def _flat(obj):
+    """Whether 'obj' is kept in Fortran order, and an array whose C order follows that memory layout (a copy if strided)."""
+    import numpy as np
+
+    if obj.flags.c_contiguous:
+        return False, obj
+    if obj.flags.f_contiguous:
+        return True, obj.T
+    return False, np.ascontiguousarray(obj)
+
+
+def _needs_descriptor(obj):
+    if obj.dtype.fields is not None or (obj.flags.f_contiguous and not obj.flags.c_contiguous):
+        return True
+    return any(n > 4294967294 for n in obj.shape)
+
+
+def _numpy_head(obj, flags):
+    """
+    Binary ndarray descriptor: flags byte, dtype string (varint size + ascii), number of dimensions and each dimension
+    as varints.
+
+    The dtype string keeps the byte order (e.g., '<f4', '>i8'). Structured dtypes are given instead as the JSON of their
+    'numpy.lib.format' description, padding included.
+    >>> import numpy as np
+    >>> _numpy_head(np.zeros((2, 300), dtype=np.float32), 0)
+    b'\\x00\\x03<f4\\x02\\x02\\xac\\x02'
+    >>> _numpy_head(np.zeros(1, dtype=[("a", ">i2"), ("b", "f8", (2,))]), 0)
+    b'\\x04\\x1d[["a",">i2"],["b","<f8",[2]]]\\x01\\x01'
+    """
+    if obj.dtype.fields is None:
+        dtype = obj.dtype.str.encode()
+    else:
+        from numpy.lib.format import dtype_to_descr
+
+        flags |= _STRUCTURED
+        dtype = orjson.dumps(dtype_to_descr(obj.dtype))
+    return b"".join([_SMALL[flags], _varint(len(dtype)), dtype, _varint(obj.ndim), *map(_varint, obj.shape)])
+
+
+def _descr_dtype(descr):
+    """Structured dtype back from its JSON description, where tuples became lists."""
+    from numpy.lib.format import descr_to_dtype
+
+    def fields(d):
+        if isinstance(d, str):
+            return d
+        return [(tuple(name) if isinstance(name, list) else name, fields(sub), *map(tuple, shape)) for name, sub, *shape in d]
+
+    return descr_to_dtype(fields(descr))
+
+
+def _deserialize_numpy2(blob, buffers):
+    import numpy as np
+
+    flags = blob[0]
+    size, pos = _read_varint(blob, 1)
+    descr = blob[pos : pos + size]
+    dtype = _descr_dtype(orjson.loads(descr)) if flags & _STRUCTURED else bytes(descr).decode()
+    ndim, pos = _read_varint(blob, pos + size)
+    shape = []
+    for _ in range(ndim):
+        n, pos = _read_varint(blob, pos)
+        shape.append(n)
+    if flags & _OUT_OF_BAND:
+        dump = buffers[_read_varint(blob, pos)[0]]
+    else:
+        dump = memoryview(blob)[pos:]
+    m = np.frombuffer(dump, dtype=dtype)
+    if ndim != 1:
+        m = m.reshape(shape, order="F" if flags & _FORTRAN else "C")
+    return m
+
+
+def deserialize_numpy(blob, buffers=None, version=1):
+    if version == 2:
+        return _deserialize_numpy2(blob, buffers)
     import numpy as np
 
-    rest_of_header_len = blob[:10].split(b"\xc2\xa7")[0]
+    dump, order = None, "C"
+    if blob[:7] == b"00oob__":
+        dump = buffers[int.from_bytes(blob[7:15], byteorder="little")]
+        order = bytes(blob[15:16]).decode()
+        blob = blob[16:]
+    rest_of_header_len = bytes(blob[:10]).split(b"\xc2\xa7")[0]
     first_len = len(rest_of_header_len)
     header_len = first_len + int(rest_of_header_len)
-    dims, dtype, hw = blob[first_len + 2 : header_len].split(b"\xc2\xa7")
+    dims, dtype, hw = bytes(blob[first_len + 2 : header_len]).split(b"\xc2\xa7")
     dims = int(dims.decode())
     dtype = dtype.decode().rstrip()
     shape = bytes2integers(hw.ljust(4 * dims))
 
-    dump = memoryview(blob)[header_len:]
+    if dump is None:
+        dump = memoryview(blob)[header_len:]
     # dump = lz4.decompress(dump)
     m = np.frombuffer(dump, dtype=dtype)
-    if dims > 1:
-        m = np.reshape(m, newshape=shape)
+    if dims != 1:
+        m = np.reshape(m, newshape=shape, order=order)
     return m
 
 
+def serialize_frame(obj, ctx):
+    """
+    Columnar DataFrame: a JSON header with index/columns metadata followed by one blob per column.
+
+    Numeric columns are raw numpy buffers (out-of-band or chunked as requested by 'ctx'),
+    str columns are dictionary-encoded 'serialize_strings()' blobs,
+    see '_enc_values()' for datetimes with time zone and categoricals, whose dtypes are kept under "d" by column position.
+    A RangeIndex is kept as its bounds, an index of str/int labels as a JSON list,
+    other indexes as one more column (or levels and codes, see '_enc_index()').
+    Other columns, indexes or labels raise the 'unsafe_fallback' exception, so that the caller can try parquet instead.
+    >>> import pandas as pd
+    >>> df = pd.DataFrame({"a": ["5", "9", "11"], 3: [7.0, 13, 19]}, index=pd.Index(["x", "y", "z"], name="id"))
+    >>> blob = serialize_frame(df, Packing(True, False))
+    >>> blob[:7], bytes(indexed_children(blob[7:])[0])
+    (b'00colf_', b'{"i":{"v":["x","y","z"],"n":"id"},"c":{"v":["a",3],"n":null}}')
+    >>> traversal_dec(blob).equals(df)
+    True
+    """
+    blobs, dtypes = [], {}
+    meta = {"i": _enc_index(obj.index, ctx, blobs), "c": _enc_index(obj.columns, ctx, blobs)}
+    for i, (_, col) in enumerate(obj.items()):
+        if (spec := _enc_values(col, ctx, blobs)) is not None:
+            dtypes[str(i)] = spec
+    if dtypes:
+        meta["d"] = dtypes
+    return _frame_blob(meta, blobs, ctx)
+
+
+def serialize_series(obj, ctx):
+    """
+    Series as a columnar frame (see 'serialize_frame()') with a single column, whose header keeps the name under "s".
+
+    The index is thus never turned into Python objects, except for str/int labels.
+    >>> import pandas as pd
+    >>> s = pd.Series([1.5, 2.5, 4], index=pd.date_range("2023-01-01", periods=3, tz="Europe/Paris"), name="x")
+    >>> blob = serialize_series(s, Packing(True, False))
+    >>> bytes(indexed_children(blob[7:])[0])
+    b'{"i":{"n":null,"d":{"z":"Europe/Paris"}},"s":"x"}'
+    >>> traversal_dec(blob).equals(s)
+    True
+    """
+    blobs = []
+    meta = {"i": _enc_index(obj.index, ctx, blobs), "s": obj.name}
+    if (spec := _enc_values(obj, ctx, blobs)) is not None:
+        meta["d"] = spec
+    return _frame_blob(meta, blobs, ctx)
+
+
+def _frame_blob(meta, blobs, ctx):
+    if ctx.version == 2:
+        return _seq_blob(b"colf_", [orjson.dumps(meta), *blobs], ctx)
+    return _indexed_blob(b"00colf_", [orjson.dumps(meta), *blobs], ctx)
+
+
+def _enc_index(idx, ctx, blobs):
+    """
+    Append the blobs of 'idx' to 'blobs', returning its metadata.
+
+    A MultiIndex is kept as its levels (each one an index) and their codes.
+    >>> import pandas as pd
+    >>> idx = pd.MultiIndex.from_arrays([["a", "a", "b"], [1.5, 2.5, 1.5]], names=["k", None])
+    >>> blobs = []
+    >>> spec = _enc_index(idx, Packing(True, False), blobs)
+    >>> spec, len(blobs)
+    ({'m': [{'v': ['a', 'b'], 'n': 'k'}, {'n': None}], 'n': ['k', None]}, 3)
+    >>> _dec_index(spec, iter(blobs), None, _dec_column).equals(idx)
+    True
+    """
+    import pandas as pd
+
+    if type(idx) is pd.MultiIndex:
+        levels = []
+        for level, codes in zip(idx.levels, idx.codes):
+            levels.append(_enc_index(level, ctx, blobs))
+            blobs.append(_enc_column(codes, codes.dtype, ctx))
+        return {"m": levels, "n": [level["n"] for level in levels]}
+    if type(idx.name) not in _LABELS:
+        raise Exception(f"Please enable 'unsafe_fallback'. Cannot handle this index name: {idx.name!r}")
+    if type(idx) is pd.RangeIndex:
+        return {"r": [idx.start, idx.stop, idx.step], "n": idx.name}
+    if idx.dtype == object:
+        labels = idx.tolist()
+        if set(map(type, labels)) <= {str, int}:
+            return {"v": labels, "n": idx.name}
+    if (spec := _enc_values(idx, ctx, blobs)) is not None:
+        return {"n": idx.name, "d": spec}
+    return {"n": idx.name}
+
+
+def _enc_values(obj, ctx, blobs):
+    """
+    Append the blobs of the values of a Series or index to 'blobs', returning the metadata of their dtype, if not a numpy one.
+
+    Time zone aware datetimes are kept as UTC datetime64 and the zone name,
+    categoricals as their codes followed by the categories (an index), see '_enc_index()'.
+    """
+    import pandas as pd
+
+    dtype, values = obj.dtype, obj.array
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        zone = str(dtype.tz)
+        try:
+            same = pd.DatetimeTZDtype(tz=zone) == dtype
+        except Exception:
+            same = False
+        if not same:
+            raise Exception(f"Please enable 'unsafe_fallback'. Cannot handle this time zone: {dtype.tz!r}")
+        utc = values.tz_convert(None).to_numpy()
+        blobs.append(_enc_column(utc, utc.dtype, ctx))
+        return {"z": zone}
+    if isinstance(dtype, pd.CategoricalDtype):
+        blobs.append(_enc_column(values.codes, values.codes.dtype, ctx))
+        return {"k": _enc_index(dtype.categories, ctx, blobs), "o": dtype.ordered}
+    blobs.append(_enc_column(obj.to_numpy(), dtype, ctx))
+
+
+def _enc_column(values, dtype, ctx):
+    import numpy as np
+
+    if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+        return _numpy_blob(values, ctx, False)
+    if dtype == object:
+        return ctx.heads[b"strs_"] + serialize_strings(values)
+    raise Exception(f"Please enable 'unsafe_fallback'. Cannot handle this column dtype: '{dtype}'")
+
+
+_LABELS = {str, int, type(None)}
+
+
+def serialize_strings(values):
+    """
+    Dictionary-encoded str array: codes into the distinct values, then the distinct values themselves.
+
+    Codes are stored as their number (little endian uint64) followed by '_narrow()' uints,
+    distinct values likewise as their number, their narrowed utf-8 lengths and the utf-8 bytes.
+    >>> blob = serialize_strings(["ab", "é", "ab"])
+    >>> blob[:12]  # Codes.
+    b'\\x03\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x01\\x00\\x01\\x00'
+    >>> blob[12:]  # Distinct values.
+    b'\\x02\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x01\\x02\\x02ab\\xc3\\xa9'
+    >>> deserialize_strings(blob)
+    array(['ab', 'é', 'ab'], dtype=object)
+    """
+    import numpy as np
+    from pandas import factorize
+
+    if len(values) < 1000:  # Both number distinct values by first appearance, the dict has less overhead.
+        index = {}
+        codes = np.array([index.setdefault(v, len(index)) for v in values], dtype=np.int64)
+        uniques = list(index)
+    else:
+        codes, uniques = factorize(np.asarray(values, dtype=object))
+        if len(codes) and codes.min() < 0:
+            raise Exception("Please enable 'unsafe_fallback'. Cannot handle missing values among strings.")
+    if set(map(type, uniques)) - {str}:
+        raise Exception("Please enable 'unsafe_fallback'. Cannot handle non-str values among strings.")
+    text = "".join(uniques)
+    data = text.encode()
+    if len(data) == len(text):
+        lengths = np.fromiter(map(len, uniques), dtype=np.uint64, count=len(uniques))
+    else:
+        encoded = [v.encode() for v in uniques]
+        lengths = np.fromiter(map(len, encoded), dtype=np.uint64, count=len(encoded))
+    return _narrow(codes) + _narrow(lengths) + data
+
+
+def deserialize_strings(blob):
+    import numpy as np
+
+    codes, pos = _widen(blob, 0)
+    lengths, pos = _widen(blob, pos)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    offsets = offsets.tolist()
+    data = bytes(blob[pos:])
+    text = data.decode()
+    if len(text) != len(data):  # Offsets count bytes, not characters.
+        text = data
+    uniques = np.empty(len(lengths), dtype=object)
+    uniques[:] = [text[a:b] for a, b in zip(offsets, offsets[1:])]
+    if text is data:
+        uniques[:] = [v.decode() for v in uniques]
+    return uniques.take(codes)
+
+
+def _narrow(values):
+    """Non-negative ints as their number (8 bytes), the smallest sufficient itemsize (1 byte) and little endian uints."""
+    top = int(values.max()) if len(values) else 0
+    itemsize = 1 if top < 256 else 2 if top < 65536 else 4 if top < 4294967296 else 8
+    return len(values).to_bytes(8, byteorder="little") + bytes([itemsize]) + values.astype(f"<u{itemsize}").tobytes()
+
+
+def _widen(blob, pos):
+    """Reverse '_narrow()' from 'blob[pos:]'. Return the uints and the position after them."""
+    import numpy as np
+
+    n, itemsize = int.from_bytes(blob[pos : pos + 8], byteorder="little"), blob[pos + 8]
+    return np.frombuffer(blob, dtype=f"<u{itemsize}", count=n, offset=pos + 9), pos + 9 + n * itemsize
+
+
 def integers2bytes(lst, n=4) -> bytes:
     """Each int becomes N bytes. max=4294967294 for 4 bytes"""
     return b"".join(d.to_bytes(n, byteorder="little") for d in lst)
@@ -0,0 +1,416 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+"""
+Registry of whole-blob compression codecs.
+
+Each codec is identified in the blob by a 7-byte tag, like the serialization headers.
+Several codecs may share a tag when they share the decompressor (e.g., lz4 and lz4 high-compression).
+"""
+import lzma
+import os
+import struct
+import zlib
+from time import perf_counter
+
+from safeserializer import instrument
+
+BLOCKSIZE = 1 << 22
+
+
+class Codec:
+    """
+    'compress'/'decompress' take and return bytes-like objects.
+    'compressor(source_size)' and 'decompressor()', when given, return incremental objects
+    with 'compress()'/'flush()' and 'decompress()'/'eof'/'unused_data' (as in zlib and lzma).
+    """
+
+    __slots__ = ("name", "tag", "compress", "decompress", "compressor", "decompressor")
+
+    def __init__(self, name, tag, compress, decompress, compressor=None, decompressor=None):
+        if len(tag) != 7:
+            raise Exception(f"Codec tag should have 7 bytes: {tag}")
+        self.name, self.tag = name, tag
+        self.compress, self.decompress = compress, decompress
+        self.compressor, self.decompressor = compressor, decompressor
+
+    def __repr__(self):
+        return f"Codec({self.name!r}, {self.tag!r})"
+
+
+CODECS = {}
+_BY_TAG = {}
+
+
+def register_codec(codec):
+    """
+    Make 'codec' available by name to 'pack()' and by tag to 'unpack()'.
+
+    A tag is decoded by the first codec registered with it (or by a newer one under the same name).
+    """
+    CODECS[codec.name] = codec
+    if codec.tag not in _BY_TAG or _BY_TAG[codec.tag].name == codec.name:
+        _BY_TAG[codec.tag] = codec
+
+
+class Adaptive:
+    """
+    Compression policy: skip compression when it is not worth it.
+
+    Blobs shorter than 'threshold' bytes are kept as they are.
+    Otherwise, a sample of up to 'sample' bytes, taken from the start, middle and end of the blob, is compressed first;
+    if it does not shrink below 'max_ratio' of its size, the blob is kept as it is.
+    'codec' is the codec name, which sets the trade-off between speed ("lz4") and ratio ("lz4hc", "zlib", "lzma").
+
+    >>> auto = Adaptive()
+    >>> auto(b"00json_true")
+    b'00json_true'
+    >>> auto(b"00json_" + b"[1,1,1,1]" * 100)[:7]
+    b'00lz4__'
+    >>> import os
+    >>> noise = b"00nmpy_" + os.urandom(10000)
+    >>> auto(noise) is noise
+    True
+    """
+
+    __slots__ = ("codec", "threshold", "sample", "max_ratio")
+
+    def __init__(self, codec="lz4", threshold=256, sample=65536, max_ratio=0.9):
+        self.codec, self.threshold, self.sample, self.max_ratio = codec, threshold, sample, max_ratio
+
+    def __call__(self, dump):
+        size = len(dump)
+        if size < self.threshold:
+            return dump
+        codec = CODECS[self.codec]
+        if size > self.sample:
+            step, view = self.sample // 3, memoryview(dump)
+            middle = (size - step) // 2
+            sample = b"".join([view[:step], view[middle : middle + step], view[size - step :]])
+            if len(codec.compress(sample)) > self.max_ratio * len(sample):
+                return dump
+            return codec.tag + codec.compress(dump)
+        compressed = codec.compress(dump)
+        if len(compressed) + 7 > self.max_ratio * size:
+            return dump
+        return codec.tag + compressed
+
+    def __repr__(self):
+        return f"Adaptive({self.codec!r}, threshold={self.threshold}, sample={self.sample}, max_ratio={self.max_ratio})"
+
+
+def compress(dump, compressed):
+    """
+    Compress an encoded dump according to 'compressed':
+        False: keep it as it is;
+        True: lz4, as always;
+        a codec name, e.g., "lz4", "lz4hc", "zlib", "lzma";
+        "auto": 'Adaptive()' policy over lz4, "auto-small": 'Adaptive("lzma")';
+        an 'Adaptive' instance;
+        "lz4-blocks" or a 'Blocks' instance: lz4 blocks compressed in parallel, with an index for random access.
+
+    >>> decompress(compress(b"00json_true", "zlib"))
+    b'00json_true'
+    >>> compress(b"00json_true", "auto")
+    b'00json_true'
+    """
+    if instrument.ACTIVE is not None:
+        start = perf_counter()
+        blob = _compress(dump, compressed)
+        codec = codec_by_tag(blob[:7]) if blob is not dump else None
+        name = "none" if codec is None else codec.name
+        instrument.ACTIVE.record("compress", name, len(dump), len(blob), perf_counter() - start)
+        return blob
+    return _compress(dump, compressed)
+
+
+def _compress(dump, compressed):
+    if not compressed:
+        return dump
+    if compressed is True:
+        compressed = "lz4"
+    if type(compressed) is str:
+        policy = _POLICIES.get(compressed)
+        if policy is None:
+            codec = CODECS[compressed]
+            return codec.tag + codec.compress(dump)
+        compressed = policy
+    return compressed(dump)
+
+
+def decompress(blob):
+    """Reverse 'compress()' according to the tag, if any. Uncompressed blobs are returned as they are."""
+    codec = _BY_TAG.get(bytes(blob[:7]))
+    if instrument.ACTIVE is not None:
+        start = perf_counter()
+        dump = blob if codec is None else codec.decompress(blob[7:])
+        name = "none" if codec is None else codec.name
+        instrument.ACTIVE.record("decompress", name, len(blob), len(dump), perf_counter() - start)
+        return dump
+    return blob if codec is None else codec.decompress(blob[7:])
+
+
+def streaming_codec(compressed, size):
+    """
+    Codec to compress incrementally a dump of 'size' bytes, None when it should stay uncompressed.
+
+    Adaptive policies only apply their size threshold, as there is no blob to sample.
+    """
+    if not compressed:
+        return None
+    if compressed is True:
+        compressed = "lz4"
+    if type(compressed) is str:
+        compressed = _POLICIES.get(compressed, compressed)
+    if isinstance(compressed, Adaptive):
+        return CODECS[compressed.codec] if size >= compressed.threshold else None
+    if isinstance(compressed, Blocks):
+        return compressed
+    return CODECS[compressed]
+
+
+def codec_by_tag(tag):
+    return _BY_TAG.get(bytes(tag))
+
+
+class _LZ4Compressor:
+    def __init__(self, level, source_size):
+        import lz4.frame as lz4
+
+        self._compressor = lz4.LZ4FrameCompressor(compression_level=level)
+        self._pending = self._compressor.begin(source_size=source_size)
+
+    def compress(self, data):
+        out, self._pending = self._pending + self._compressor.compress(data), b""
+        return out
+
+    def flush(self):
+        return self._pending + self._compressor.flush()
+
+
+def _lz4_compress(data, level=0):
+    import lz4.frame as lz4
+
+    return lz4.compress(data, compression_level=level)
+
+
+def _lz4_decompress(data):
+    import lz4.frame as lz4
+
+    return lz4.decompress(data)
+
+
+def _lz4_decompressor():
+    import lz4.frame as lz4
+
+    return lz4.LZ4FrameDecompressor()
+
+
+class Blocks:
+    """
+    Codec that cuts the dump into fixed-size blocks, each one lz4-compressed on its own, followed by a block index.
+
+    Blocks of a whole blob are compressed and decompressed in parallel on 'executor' (python-lz4 releases the GIL);
+    by default, a thread pool shared by all instances, with one thread per CPU.
+    'BlockReader' decompresses a single block or byte range, without touching the others.
+    Also registered by name, with default settings: 'pack(..., compressed="lz4-blocks")'.
+
+    Layout after the 7-byte tag:
+        each block: compressed size and raw size (little endian uint32), then the compressed data;
+        8 zero bytes;
+        index: block size and block count (uint64), then the offset of each block (uint64, from the end of the tag);
+        offset of the index (uint64).
+
+    >>> dump = b"00json_" + b"[1,2,3]" * 1000
+    >>> blob = compress(dump, Blocks(blocksize=1000))
+    >>> blob[:7], decompress(blob) == dump
+    (b'00lz4b_', True)
+    >>> reader = BlockReader(blob)
+    >>> len(reader), reader.size, reader[7]
+    (8, 7007, b'[1,2,3]')
+    >>> reader.read(995, 1010)
+    b'1,2,3][1,2,3][1'
+    """
+
+    __slots__ = ("blocksize", "executor")
+    name = "lz4-blocks"
+    tag = b"00lz4b_"
+
+    def __init__(self, blocksize=BLOCKSIZE, executor=None):
+        self.blocksize, self.executor = blocksize, executor
+
+    def __call__(self, dump):
+        return self.tag + self.compress(dump)
+
+    def compress(self, data):
+        compressor = _BlocksCompressor(self)
+        return compressor._blocks(data) + compressor.flush()
+
+    def decompress(self, data):
+        reader = BlockReader(data, tagged=False)
+        return b"".join(self._map(reader.__getitem__, range(len(reader))))
+
+    def compressor(self, source_size):
+        return _BlocksCompressor(self)
+
+    def decompressor(self):
+        return _BlocksDecompressor()
+
+    def _map(self, fun, items):
+        if len(items) < 2:
+            return list(map(fun, items))
+        return list((self.executor or _pool()).map(fun, items))
+
+    def __repr__(self):
+        return f"Blocks(blocksize={self.blocksize})"
+
+
+class BlockReader:
+    """Random access to the blocks of a blob compressed by 'Blocks' (after its tag, when 'tagged=False')."""
+
+    def __init__(self, blob, tagged=True):
+        view = memoryview(blob)
+        self._body = view[7:] if tagged else view
+        index = int.from_bytes(self._body[-8:], byteorder="little")
+        self.blocksize, n = struct.unpack_from("<2Q", self._body, index)
+        self._offsets = struct.unpack_from(f"<{n}Q", self._body, index + 16)
+        last = struct.unpack_from("<I", self._body, self._offsets[-1] + 4)[0] if n else 0
+        self.size = max(n - 1, 0) * self.blocksize + last
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        import lz4.block
+
+        offset = self._offsets[i]
+        csize, size = struct.unpack_from("<2I", self._body, offset)
+        return lz4.block.decompress(self._body[offset + 8 : offset + 8 + csize], uncompressed_size=size)
+
+    def read(self, start, stop):
+        """Bytes 'start' to 'stop' of the decompressed dump, decompressing only the blocks they span."""
+        stop = min(stop, self.size)
+        if start >= stop:
+            return b""
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        data = b"".join(self[i] for i in range(first, last + 1))
+        begin = start - first * self.blocksize
+        return data[begin : begin + stop - start]
+
+
+class _BlocksCompressor:
+    """Incremental 'Blocks' compression: full blocks are compressed as soon as enough of them are buffered."""
+
+    def __init__(self, codec):
+        self._codec = codec
+        self._pending = bytearray()
+        self._offsets = []
+        self._position = 0
+
+    def compress(self, data):
+        self._pending += data
+        blocksize = self._codec.blocksize
+        if len(self._pending) < blocksize * (os.cpu_count() or 1):
+            return b""
+        size = len(self._pending) // blocksize * blocksize
+        full = self._pending[:size]
+        del self._pending[:size]
+        return self._blocks(full)
+
+    def flush(self):
+        out = self._blocks(self._pending)
+        n = len(self._offsets)
+        return out + struct.pack(f"<8x{n + 3}Q", self._codec.blocksize, n, *self._offsets, self._position + 8)
+
+    def _blocks(self, data):
+        import lz4.block
+
+        blocksize = self._codec.blocksize
+        with memoryview(data) as view:
+            chunks = [view[i : i + blocksize] for i in range(0, len(view), blocksize)]
+            compressed = self._codec._map(lambda chunk: lz4.block.compress(chunk, store_size=False), chunks)
+            out = []
+            for chunk, block in zip(chunks, compressed):
+                self._offsets.append(self._position)
+                out.append(struct.pack("<2I", len(block), len(chunk)))
+                out.append(block)
+                self._position += 8 + len(block)
+                chunk.release()
+        return b"".join(out)
+
+
+class _BlocksDecompressor:
+    """Incremental 'Blocks' decompression, block by block, with 'eof' and 'unused_data' as in zlib."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._index = None  # Size of the index and trailer, once all blocks are read.
+        self.eof = False
+        self.unused_data = b""
+
+    def decompress(self, data):
+        import lz4.block
+
+        self._buffer += data
+        out, pos = [], 0
+        while self._index is None and len(self._buffer) - pos >= 8:
+            csize, size = struct.unpack_from("<2I", self._buffer, pos)
+            if not csize:
+                pos += 8
+                self._index = -1
+            elif len(self._buffer) - pos - 8 >= csize:
+                out.append(lz4.block.decompress(memoryview(self._buffer)[pos + 8 : pos + 8 + csize], uncompressed_size=size))
+                pos += 8 + csize
+            else:
+                break
+        del self._buffer[:pos]
+        if self._index == -1 and len(self._buffer) >= 16:
+            self._index = 16 + 8 * int.from_bytes(self._buffer[8:16], byteorder="little") + 8
+        if self._index is not None and self._index >= 0 and len(self._buffer) >= self._index:
+            self.eof, self.unused_data = True, bytes(self._buffer[self._index :])
+        return b"".join(out)
+
+
+_POOL = None
+
+
+def _pool():
+    global _POOL
+    if _POOL is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _POOL = ThreadPoolExecutor(os.cpu_count(), thread_name_prefix="safeserializer-blocks")
+    return _POOL
+
+
+register_codec(
+    Codec("lz4", b"00lz4__", _lz4_compress, _lz4_decompress, lambda size: _LZ4Compressor(0, size), _lz4_decompressor)
+)
+register_codec(
+    Codec("lz4hc", b"00lz4__", lambda data: _lz4_compress(data, 9), _lz4_decompress, lambda size: _LZ4Compressor(9, size),
+          _lz4_decompressor)
+)
+register_codec(Codec("zlib", b"00zlib_", zlib.compress, zlib.decompress, lambda size: zlib.compressobj(), zlib.decompressobj))
+register_codec(
+    Codec("lzma", b"00lzma_", lzma.compress, lzma.decompress, lambda size: lzma.LZMACompressor(), lzma.LZMADecompressor)
+)
+register_codec(Blocks())
+_POLICIES = {"auto": Adaptive(), "auto-small": Adaptive("lzma")}
@@ -0,0 +1,165 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+import bson
+from orjson import orjson
+
+from safeserializer.compression import (
+    Chunks,
+    Packing,
+    _finish,
+    _indexed_blob,
+    _map_blob,
+    _nbytes,
+    _seq_blob,
+    _walk,
+    indexed_children,
+)
+from safeserializer.compressors import compress, decompress
+
+
+def pack_delta(obj, base_blob, ensure_determinism=True, unsafe_fallback=False, compressed=True):
+    """
+    Serialize 'obj' as the changes from 'base_blob', a version 1 blob produced by 'pack()' (or 'apply_delta()').
+
+    Dicts with str keys and lists are matched child by child against the 'dict_'/'list_' containers of the base
+    (or their indexed counterparts); only children whose encoding differs are written, along with a structural patch
+    telling which children are kept, replaced, added or dropped.
+    Other nodes (e.g., pure JSON subtrees, which are a single blob) are kept or replaced as a whole.
+    Children are still encoded to be compared, but arrays are compared in place and only the delta is compressed.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack, unpack
+    >>> state = {"step": 1, "weights": np.arange(100000.), "log": [b"start", {"loss": 0.5}], "tags": {"a": 1}}
+    >>> base = pack(state, ensure_determinism=True, unsafe_fallback=False)
+    >>> state["step"], state["log"] = 2, [b"start", {"loss": 0.5}, b"step"]
+    >>> delta = pack_delta(state, base)
+    >>> len(delta) < 200 < len(base)
+    True
+    >>> unpack(delta)
+    Traceback (most recent call last):
+    ...
+    Exception: Cannot unpack a delta blob alone: rebuild the full blob with 'apply_delta(base_blob, delta_blob)'.
+    >>> new = unpack(apply_delta(base, delta))
+    >>> new["step"], new["log"], new["weights"][-1]
+    (2, [b'start', {'loss': 0.5}, b'step'], 99999.0)
+    """
+    ctx = Packing(ensure_determinism, unsafe_fallback, chunked=True)
+    blobs = []
+    patch = _diff(obj, memoryview(decompress(base_blob)), ctx, blobs)
+    delta = _indexed_blob(b"00dlta_", [orjson.dumps(patch), *blobs], ctx)
+    return compress(b"".join(delta.leaves()), compressed)
+
+
+def apply_delta(base_blob, delta_blob, compressed=False):
+    """
+    Blob of the object described by 'delta_blob' (from 'pack_delta()') over 'base_blob'.
+
+    The result is readable by 'unpack()' and can be the base of the next delta. It is left uncompressed by default,
+    so that a chain of snapshots does not recompress the whole state at each step.
+    """
+    delta = memoryview(decompress(delta_blob))
+    if delta[:7] != b"00dlta_":
+        raise Exception("Not a delta blob.")
+    children = indexed_children(delta[7:])
+    dump = _apply(orjson.loads(bytes(children[0])), memoryview(decompress(base_blob)), children[1:])
+    return compress(dump, compressed)
+
+
+def _children(node):
+    """Children of a version 1 container blob: a dict for 'dict_'/'idct_', a list for 'list_'/'ilst_', otherwise None."""
+    header = bytes(node[2:7])
+    if header == b"dict_":
+        return bson.decode(bytes(node[7:]))
+    if header == b"idct_":
+        children = indexed_children(node[7:])
+        return {bytes(children[i]).decode(): children[i + 1] for i in range(0, len(children), 2)}
+    if header == b"list_":
+        return bson.decode(bytes(node[7:]))["_"]
+    if header == b"ilst_":
+        return indexed_children(node[7:])
+    return None
+
+
+def _diff(obj, node, ctx, blobs):
+    """
+    Patch turning the blob 'node' into the encoding of 'obj': 0 to keep it, n to replace it by the n-th new blob,
+    {"d": [[key, patch], ...]} or {"l": [patch, ...]} to rebuild a dict or list from the patches of its children.
+    """
+    typ = type(obj)
+    children = _children(node) if typ is dict or typ is list else None
+    if typ is dict and type(children) is dict and all(type(k) is str for k in obj):
+        patch = [[k, _diff(o, children[k], ctx, blobs) if k in children else _new(o, ctx, blobs)] for k, o in obj.items()]
+        if any(p for _, p in patch) or list(obj) != list(children):
+            return {"d": patch}
+        return 0
+    if typ is list and type(children) is list:
+        patch = [_diff(o, children[i], ctx, blobs) if i < len(children) else _new(o, ctx, blobs) for i, o in enumerate(obj)]
+        if any(patch) or len(obj) != len(children):
+            return {"l": patch}
+        return 0
+    blob = _finish(*_walk(obj, ctx), ctx)
+    if _same(blob, node):
+        return 0
+    blobs.append(blob)
+    return len(blobs)
+
+
+def _new(obj, ctx, blobs):
+    blobs.append(_finish(*_walk(obj, ctx), ctx))
+    return len(blobs)
+
+
+def _same(blob, node):
+    """Whether the encoded 'blob' (bytes or 'Chunks') has the same content as 'node', compared buffer by buffer."""
+    if _nbytes(blob) != len(node):
+        return False
+    pos = 0
+    for chunk in blob.leaves() if type(blob) is Chunks else [blob]:
+        n = len(chunk) if type(chunk) is bytes else chunk.nbytes
+        if not _equal(chunk, node[pos : pos + n]):
+            return False
+        pos += n
+    return True
+
+
+def _equal(a, b):
+    if len(b) >= 65536:  # Large buffers are ndarray memory: compared in place instead of copied.
+        try:
+            import numpy as np
+        except ImportError:  # pragma: no cover
+            pass
+        else:
+            return np.array_equal(np.frombuffer(a, dtype=np.uint8), np.frombuffer(b, dtype=np.uint8))
+    return bytes(a) == bytes(b)
+
+
+def _apply(patch, node, blobs):
+    if patch == 0:
+        return bytes(node)
+    if type(patch) is int:
+        return bytes(blobs[patch - 1])
+    children = _children(node)
+    ctx = Packing(True, False, indexed=bytes(node[2:7]) in (b"idct_", b"ilst_"))
+    if "d" in patch:
+        return _map_blob(b"dict_", {k: _apply(p, children.get(k), blobs) for k, p in patch["d"]}, ctx)
+    items = [_apply(p, children[i] if i < len(children) else None, blobs) for i, p in enumerate(patch["l"])]
+    return _seq_blob(b"list_", items, ctx)
@@ -0,0 +1,58 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+import hashlib
+
+from safeserializer.compression import Packing, _encode
+
+
+def digest(obj, algo="blake2b", unsafe_fallback=False):
+    """
+    Content hash of 'obj': the 'hashlib' algorithm 'algo' over its canonical encoding, as 'bytes'.
+
+    Equal objects have the same digest, regardless of the insertion order of their dicts (see 'Packing', 'canonical=True').
+    The encoding is the one of 'pack(obj, ensure_determinism=True, compressed=False, canonical=True)',
+    but it is fed to the hasher buffer by buffer instead of being joined and compressed:
+    ndarray memory is hashed in place.
+    'unsafe_fallback=True' hashes the pickle of objects that have no safe encoding.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack
+    >>> a = {"x": np.arange(6).reshape(2, 3), 5: [1, b"z"], "y": 2}
+    >>> b = {"y": 2, 5: [1, b"z"], "x": np.asfortranarray(np.arange(6).reshape(2, 3))}
+    >>> digest(a) == digest(b)
+    True
+    >>> dump = pack(a, ensure_determinism=True, unsafe_fallback=False, compressed=False, canonical=True)
+    >>> digest(a) == hashlib.blake2b(dump).digest()
+    True
+    >>> digest({"a": 1, "b": 2}, "sha256").hex()[:16] == digest({"b": 2, "a": 1}, "sha256").hex()[:16]
+    True
+    >>> digest({"a": 1}) == digest({"a": 2})
+    False
+    """
+    h = hashlib.new(algo)
+    dump = _encode(obj, Packing(True, unsafe_fallback, chunked=True, canonical=True))
+    if type(dump) is bytes:
+        h.update(dump)
+    else:
+        for chunk in dump.leaves():
+            h.update(chunk)
+    return h.digest()
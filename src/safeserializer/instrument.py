@@ -0,0 +1,137 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+"""
+Opt-in counters of what packing and unpacking actually do.
+
+The hooks only look at 'ACTIVE', which is None unless stats are being collected.
+"""
+from contextlib import contextmanager
+from threading import Lock
+
+ACTIVE = None
+
+
+class Stats:
+    """
+    Per-operation and per-header counters, plus the fallbacks taken while encoding.
+
+    Operations:
+        "encode": each blob emitted, by header ('json_', 'list_', 'nmpy_', 'pckl_', ...);
+        "decode": each blob decoded, by header;
+        "numpy": 'serialize_numpy()' calls, by dtype;
+        "compress"/"decompress": whole-blob codec step, by codec name ("none" when left uncompressed).
+    Times of "encode" and "decode" are inclusive: a container also counts the time spent on its children.
+
+    Each fallback records the object path from the packed root (None when not reachable through lists, tuples and dicts),
+    the object type, the header tried next and the error that caused it. Only the first 'max_fallbacks' are kept.
+
+    Calls made by worker processes (e.g., 'pack_many(..., executor="process")') are not seen.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack, unpack
+    >>> with collect() as stats:
+    ...     blob = pack({"a": np.arange(3), "b": [1, b"x"], "f": [print]}, ensure_determinism=True, unsafe_fallback=True)
+    ...     _ = unpack(blob)
+    >>> snapshot = stats.snapshot()
+    >>> sorted(snapshot["encode"]), sorted(snapshot["decode"])
+    (['bson_', 'dict_', 'list_', 'nmpy_', 'pckl_'], ['bson_', 'dict_', 'list_', 'nmpy_', 'pckl_'])
+    >>> snapshot["numpy"]["int64"]["bytes_in"], snapshot["compress"]["lz4"]["calls"]
+    (24, 1)
+    >>> [(f["path"], f["type"], f["to"]) for f in snapshot["fallbacks"]]
+    [("['f'][0]", 'builtin_function_or_method', 'bson_'), ("['f'][0]", 'builtin_function_or_method', 'pckl_')]
+    >>> stats.reset()
+    >>> stats.snapshot()["encode"]
+    {}
+    """
+
+    __slots__ = ("counters", "fallbacks", "dropped", "max_fallbacks", "_lock")
+
+    def __init__(self, max_fallbacks=1000):
+        self.counters = {}  # (op, name) -> [calls, bytes_in, bytes_out, seconds]
+        self.fallbacks = []
+        self.dropped = 0
+        self.max_fallbacks = max_fallbacks
+        self._lock = Lock()
+
+    def record(self, op, name, bytes_in, bytes_out, seconds):
+        with self._lock:
+            counter = self.counters.get((op, name))
+            if counter is None:
+                counter = self.counters[op, name] = [0, 0, 0, 0.0]
+            counter[0] += 1
+            counter[1] += bytes_in
+            counter[2] += bytes_out
+            counter[3] += seconds
+
+    def fallback(self, path, typ, to, error):
+        with self._lock:
+            if len(self.fallbacks) < self.max_fallbacks:
+                self.fallbacks.append({"path": path, "type": typ.__name__, "to": to, "error": error})
+            else:
+                self.dropped += 1
+
+    def snapshot(self):
+        """Plain dict copy of the counters: {op: {name: {"calls", "bytes_in", "bytes_out", "seconds"}}, "fallbacks": [...]}."""
+        with self._lock:
+            snapshot = {op: {} for op in ["encode", "decode", "numpy", "compress", "decompress"]}
+            for (op, name), (calls, bytes_in, bytes_out, seconds) in self.counters.items():
+                snapshot[op][name] = {"calls": calls, "bytes_in": bytes_in, "bytes_out": bytes_out, "seconds": seconds}
+            snapshot["fallbacks"] = [dict(f) for f in self.fallbacks]
+            snapshot["dropped_fallbacks"] = self.dropped
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.fallbacks.clear()
+            self.dropped = 0
+
+    def __repr__(self):
+        return f"Stats({len(self.counters)} counters, {len(self.fallbacks) + self.dropped} fallbacks)"
+
+
+@contextmanager
+def collect(stats=None):
+    """
+    Collect into 'stats' (a new 'Stats' by default) within the block, in every thread.
+
+    The previous collector is restored on exit.
+    """
+    global ACTIVE
+    stats = Stats() if stats is None else stats
+    previous, ACTIVE = ACTIVE, stats
+    try:
+        yield stats
+    finally:
+        ACTIVE = previous
+
+
+def enable(stats=None):
+    """Start collecting process-wide into 'stats' (a new 'Stats' by default) until 'disable()'. Return the collector."""
+    global ACTIVE
+    ACTIVE = Stats() if stats is None else stats
+    return ACTIVE
+
+
+def disable():
+    global ACTIVE
+    ACTIVE = None
@@ -0,0 +1,188 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+import mmap
+import os
+import struct
+from functools import lru_cache
+from collections.abc import Mapping, Sequence
+
+from safeserializer.compression import _DECODERS, MAGIC, _decode, deserialize_numpy, indexed_children, traversal_dec
+from safeserializer.compressors import BlockReader, Blocks, codec_by_tag
+
+
+def lazy_unpack(path_or_buffer, buffers=None):
+    """
+    Open a blob packed with 'indexed=True' without decoding it.
+
+    A path is memory-mapped read-only; any other argument must support the buffer protocol.
+    Indexed containers come back as read-only 'LazySequence'/'LazyMapping' proxies that decode each child
+    on first access. Arrays view the mapped memory directly, so only the pages actually read are touched.
+    Other nodes are decoded as 'unpack()' would do.
+    A blob compressed by 'Blocks' is read block by block: a proxy decompresses only the blocks spanned by
+    the children it decodes. Any other compressed blob has to be decompressed as a whole first.
+
+    >>> import numpy as np
+    >>> from tempfile import TemporaryDirectory
+    >>> from safeserializer import pack_to
+    >>> obj = {"arr": np.arange(4), "meta": {"name": "x"}, "rows": [b"a", np.ones(2), (1, 2)], (1, "a"): 2}
+    >>> with TemporaryDirectory() as tmp:
+    ...     with open(f"{tmp}/blob", "wb") as f:
+    ...         _ = pack_to(f, obj, ensure_determinism=True, unsafe_fallback=False, compressed=False, indexed=True)
+    ...     lazy = lazy_unpack(f"{tmp}/blob")
+    ...     lazy
+    ...     arr = lazy["arr"]
+    ...     arr, arr.flags.writeable
+    ...     lazy["rows"]
+    ...     lazy["rows"][1], tuple(lazy["rows"][2]), lazy[(1, "a")]
+    ...     del lazy, arr
+    <LazyMapping with 4 keys>
+    (array([0, 1, 2, 3]), False)
+    <LazySequence with 3 items>
+    (array([1., 1.]), (1, 2), 2)
+    >>> from safeserializer import Blocks, pack
+    >>> blob = pack({"big": np.zeros(10_000), "small": [1, 2]}, ensure_determinism=True, unsafe_fallback=False,
+    ...             compressed=Blocks(blocksize=1000), indexed=True)
+    >>> lazy = lazy_unpack(blob)
+    >>> lazy["small"][1], lazy._values["big"].reader.block.cache_info().currsize
+    (2, 2)
+    >>> lazy["big"].sum(), lazy._values["big"].reader.block.cache_info().currsize > 2
+    (0.0, True)
+    """
+    if isinstance(path_or_buffer, (str, os.PathLike)):
+        with open(path_or_buffer, "rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    else:
+        view = memoryview(path_or_buffer)
+    codec = codec_by_tag(view[:7])
+    if isinstance(codec, Blocks):
+        view = _BlockView(_Blocks(BlockReader(view)))
+    elif codec is not None:
+        view = memoryview(codec.decompress(view[7:]))
+    if bytes(view[:7]) == MAGIC:  # Version 2 has no indexed framing.
+        return _decode(memoryview(bytes(view)) if isinstance(view, _BlockView) else view, buffers)
+    return _lazy(view, buffers)
+
+
+def _lazy(view, buffers):
+    header = bytes(view[2:7])
+    if header in (b"ilst_", b"itpl_"):
+        return LazySequence(view[7:], buffers)
+    if header in (b"idct_", b"idcB_"):
+        return LazyMapping(view[7:], header == b"idcB_", buffers)
+    if isinstance(view, _BlockView):
+        view = memoryview(bytes(view))
+    if header == b"nmpy_":
+        return deserialize_numpy(view[7:], buffers)
+    if header in (b"colf_", b"ndar_"):
+        return _DECODERS[header](view[7:], buffers)
+    if header == b"npdf_":
+        from pandas import DataFrame
+
+        return DataFrame(deserialize_numpy(view[7:], buffers))
+    return traversal_dec(bytes(view), buffers)
+
+
+class LazySequence(Sequence):
+    """Read-only view of an indexed list/tuple. Children are located through the offset table and decoded once."""
+
+    def __init__(self, body, buffers=None):
+        self._body = body
+        self._buffers = buffers
+        self._n = int.from_bytes(bytes(body[:8]), byteorder="little")
+        self._start = 16 + 8 * self._n
+        self._cache = {}
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("LazySequence index out of range")
+        if i not in self._cache:
+            a, b = struct.unpack("<2Q", bytes(self._body[8 + 8 * i : 24 + 8 * i]))
+            self._cache[i] = _lazy(self._body[self._start + a : self._start + b], self._buffers)
+        return self._cache[i]
+
+    def __repr__(self):
+        return f"<LazySequence with {self._n} items>"
+
+
+class LazyMapping(Mapping):
+    """Read-only view of an indexed dict. Keys are decoded when opening, values on first access."""
+
+    def __init__(self, body, encoded_keys=False, buffers=None):
+        self._buffers = buffers
+        children = indexed_children(body)
+        keys = children[::2]
+        keys = [traversal_dec(bytes(k)) for k in keys] if encoded_keys else [str(bytes(k), "utf-8") for k in keys]
+        self._values = dict(zip(keys, children[1::2]))
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = _lazy(self._values[key], self._buffers)
+        return self._cache[key]
+
+    def __repr__(self):
+        return f"<LazyMapping with {len(self._values)} keys>"
+
+
+class _Blocks:
+    """'BlockReader' keeping the most recently decompressed blocks, since neighbouring children share them."""
+
+    def __init__(self, reader):
+        self.size, self.blocksize = reader.size, reader.blocksize
+        self.block = lru_cache(maxsize=8)(reader.__getitem__)
+
+    def read(self, start, stop):
+        first, last = start // self.blocksize, (stop - 1) // self.blocksize
+        data = b"".join(self.block(i) for i in range(first, last + 1))
+        begin = start - first * self.blocksize
+        return data[begin : begin + stop - start]
+
+
+class _BlockView:
+    """Byte range of a decompressed 'Blocks' dump, sliced like a memoryview and read only by 'bytes()'."""
+
+    def __init__(self, reader, start=0, stop=None):
+        self.reader, self.start = reader, start
+        self.stop = reader.size if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, item):
+        start, stop, _ = item.indices(len(self))
+        return _BlockView(self.reader, self.start + start, self.start + max(start, stop))
+
+    def __bytes__(self):
+        return self.reader.read(self.start, self.stop) if self.stop > self.start else b""
@@ -0,0 +1,151 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+
+from safeserializer.compression import traversal_enc, unpack
+
+ALIGNMENT = 64
+
+_SEGMENTS = {}  # Segments mapped by this process: name -> [SharedMemory, number of references].
+_LOCK = Lock()
+
+
+class SharedHandle:
+    """
+    Small picklable reference to an object packed by 'pack_shared()' into a shared memory segment.
+
+    The segment holds the metadata blob, followed by the out-of-band buffers (ndarray memory),
+    each aligned to 'ALIGNMENT' bytes.
+    Send the handle to another process (e.g., through a pipe or queue) and call 'unpack_shared()' there.
+
+    Each process counts its own references to the segment: one for 'pack_shared()', one per 'unpack_shared()'.
+    'release()' drops one of them; the last one unmaps the segment, which must not be in use anymore by unpacked objects.
+    The segment itself lives until 'unlink()' is called, by any process
+    (usually the consumer, see 'unpack_shared(..., unlink=True)').
+    Used as a context manager, the handle is released on exit.
+    """
+
+    __slots__ = ("name", "meta", "buffers")
+
+    def __init__(self, name, meta, buffers):
+        self.name, self.meta, self.buffers = name, meta, buffers
+
+    def __getstate__(self):
+        return self.name, self.meta, self.buffers
+
+    def __setstate__(self, state):
+        self.name, self.meta, self.buffers = state
+
+    def release(self):
+        """Drop a reference of this process to the segment, unmapping it with the last one."""
+        with _LOCK:
+            entry = _SEGMENTS.get(self.name)
+            if entry is None:
+                raise Exception(f"Shared segment {self.name!r} is not mapped by this process.")
+            entry[1] -= 1
+            if entry[1]:
+                return
+            try:
+                entry[0].close()
+            except BufferError:
+                entry[1] += 1
+                raise BufferError(f"Objects unpacked from shared segment {self.name!r} are still in use.") from None
+            del _SEGMENTS[self.name]
+
+    def unlink(self):
+        """Destroy the segment name. Processes that mapped it keep their mapping until they release it."""
+        shm = _attach(self.name)
+        try:
+            shm.unlink()
+        finally:
+            self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        return f"SharedHandle({self.name!r}, {self.meta[1]} bytes + {len(self.buffers)} buffers)"
+
+
+def pack_shared(obj, ensure_determinism=True, unsafe_fallback=False, version=1):
+    """
+    Serialize 'obj' into a new shared memory segment, returning its 'SharedHandle'.
+
+    ndarray (and numeric pandas) memory is copied once, from the object to the segment; nothing is compressed.
+
+    >>> import numpy as np
+    >>> handle = pack_shared({"a": np.arange(10**6), "b": [1, "x"]})
+    >>> obj = unpack_shared(handle, unlink=True)
+    >>> obj["a"][-1], obj["b"], obj["a"].base is not None
+    (999999, [1, 'x'], True)
+    >>> del obj
+    >>> handle.release(), handle.release()
+    (None, None)
+    """
+    views = []
+    meta = traversal_enc(obj, ensure_determinism, unsafe_fallback, buffer_callback=views.append, version=version)
+    spans, offset = [], len(meta)
+    for view in views:
+        offset += -offset % ALIGNMENT
+        spans.append((offset, view.nbytes))
+        offset += view.nbytes
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    buf = shm.buf
+    buf[: len(meta)] = meta
+    for (start, size), view in zip(spans, views):
+        buf[start : start + size] = view.cast("B") if view.format != "B" else view
+    del buf
+    with _LOCK:
+        _SEGMENTS[shm.name] = [shm, 1]
+    return SharedHandle(shm.name, (0, len(meta)), spans)
+
+
+def unpack_shared(handle, unlink=False):
+    """
+    Deserialize the object referenced by 'handle', adding a reference of this process to the segment.
+
+    Arrays are not copied: they view the segment,
+    which should be released ('handle.release()') only once they are no longer used.
+    'unlink=True' destroys the segment name right after mapping it, for a one-shot transfer:
+    the memory is freed when the last process that mapped it releases it (on Windows, when the last handle is closed).
+    """
+    shm = _attach(handle.name)
+    buf = shm.buf
+    start, size = handle.meta
+    obj = unpack(bytes(buf[start : start + size]), [buf[a : a + n] for a, n in handle.buffers])
+    del buf
+    if unlink:
+        shm.unlink()
+    return obj
+
+
+def _attach(name):
+    with _LOCK:
+        entry = _SEGMENTS.get(name)
+        if entry is None:
+            entry = _SEGMENTS[name] = [SharedMemory(name), 0]
+        entry[1] += 1
+        return entry[0]
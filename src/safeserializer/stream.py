@@ -0,0 +1,218 @@
+#  Copyright (c) 2023. Davi Pereira dos Santos
+#  This file is part of the safeserializer project.
+#  Please respect the license - more about this in the section (*) below.
+#
+#  safeserializer is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  safeserializer is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with safeserializer.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  (*) Removing authorship by any means, e.g. by distribution of derived
+#  works or verbatim, obfuscated, compiled or rewritten versions of any
+#  part of this work is illegal and unethical regarding the effort and
+#  time spent here.
+from io import BytesIO
+from time import perf_counter
+
+from safeserializer import instrument
+from safeserializer.compression import Packing, _decode, _encode, _nbytes
+from safeserializer.compressors import codec_by_tag, streaming_codec
+
+CHUNKSIZE = 1 << 20
+
+
+def pack_to(fileobj, obj, ensure_determinism, unsafe_fallback, compressed=True, chunksize=CHUNKSIZE, indexed=False,
+            dedup=False, cache=None, version=1):
+    """
+    Serialize 'obj' into the writable binary 'fileobj', producing the same format as 'pack()'.
+
+    Containers and arrays are not concatenated in memory: their buffers are pushed,
+    at most 'chunksize' bytes at a time, through an incremental compressor.
+    'compressed' accepts the same values as in 'pack()', but adaptive policies only look at the size threshold here.
+    Return the number of bytes written.
+    'indexed=True' frames containers with an offset table, see 'lazy_unpack()'.
+    'dedup', 'cache' and 'version' are as in 'pack()'.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack, unpack
+    >>> obj = {"a": np.arange(5), "b": [b"bytes", 2]}
+    >>> f = BytesIO()
+    >>> pack_to(f, obj, ensure_determinism=True, unsafe_fallback=False, chunksize=16) == len(f.getvalue())
+    True
+    >>> unpack(f.getvalue())
+    {'a': array([0, 1, 2, 3, 4]), 'b': [b'bytes', 2]}
+    >>> f = BytesIO()
+    >>> _ = pack_to(f, obj, ensure_determinism=True, unsafe_fallback=False, compressed=False)
+    >>> f.getvalue() == pack(obj, ensure_determinism=True, unsafe_fallback=False, compressed=False)
+    True
+    >>> f = BytesIO()
+    >>> _ = pack_to(f, obj, ensure_determinism=True, unsafe_fallback=False, compressed="zlib")
+    >>> _ = f.seek(0)
+    >>> unpack_from(f)["a"]
+    array([0, 1, 2, 3, 4])
+    """
+    ctx = Packing(ensure_determinism, unsafe_fallback, chunked=True, indexed=indexed, dedup=dedup, cache=cache,
+                  version=version)
+    dump = _encode(obj, ctx)
+    size = _nbytes(dump)
+    chunks = [dump] if type(dump) is bytes else dump.leaves()
+    codec = streaming_codec(compressed, size)
+    if codec is None:
+        for chunk in chunks:
+            fileobj.write(chunk)
+        return size
+
+    start = perf_counter()
+    written = fileobj.write(codec.tag) or 7
+    compressor = codec.compressor(size)
+    for chunk in chunks:
+        chunk = memoryview(chunk)
+        for i in range(0, len(chunk), chunksize):
+            out = compressor.compress(chunk[i : i + chunksize])
+            if out:
+                written += fileobj.write(out) or len(out)
+    out = compressor.flush()
+    written += fileobj.write(out) or len(out)
+    if instrument.ACTIVE is not None:
+        instrument.ACTIVE.record("compress", codec.name, size, written, perf_counter() - start)
+    return written
+
+
+def pack_into(buf, obj, ensure_determinism, unsafe_fallback, offset=0, compressed=False, indexed=False, dedup=False,
+              cache=None, version=1):
+    """
+    Serialize 'obj' into the writable buffer 'buf', from 'offset' on, returning the number of bytes written.
+
+    Each encoded piece (headers, lengths, array memory) is copied once, straight to its place in 'buf',
+    so that memory use does not grow with the nesting depth, unlike concatenating the blob of every container.
+    A 'bytearray' grows as needed; other buffers (e.g., 'mmap', shared memory) must be large enough, see 'packed_size()',
+    otherwise 'ValueError' is raised.
+    The other arguments are as in 'pack_to()', except that the output is not compressed by default.
+
+    >>> import numpy as np
+    >>> from safeserializer import pack, unpack
+    >>> obj = {"a": np.arange(5), "b": [[b"bytes"], 2]}
+    >>> buf = bytearray(packed_size(obj, ensure_determinism=True, unsafe_fallback=False))
+    >>> pack_into(buf, obj, ensure_determinism=True, unsafe_fallback=False) == len(buf)
+    True
+    >>> bytes(buf) == pack(obj, ensure_determinism=True, unsafe_fallback=False, compressed=False)
+    True
+    >>> buf = bytearray(b"head")
+    >>> n = pack_into(buf, obj, ensure_determinism=True, unsafe_fallback=False, offset=4, compressed="zlib")
+    >>> unpack(bytes(buf[4 : 4 + n]))["b"]
+    [[b'bytes'], 2]
+    >>> buf = bytearray(b"head")
+    >>> n = pack_into(buf, obj, ensure_determinism=True, unsafe_fallback=False, offset=10)
+    >>> bytes(buf[:10]), len(buf) == 10 + n, unpack(bytes(buf[10:]))["b"]
+    (b'head\\x00\\x00\\x00\\x00\\x00\\x00', True, [[b'bytes'], 2])
+    >>> pack_into(memoryview(bytearray(8)), obj, ensure_determinism=True, unsafe_fallback=False)
+    Traceback (most recent call last):
+    ...
+    ValueError: Buffer too small: 8 bytes.
+    """
+    return pack_to(_Into(buf, offset), obj, ensure_determinism, unsafe_fallback, compressed, indexed=indexed, dedup=dedup,
+                   cache=cache, version=version)
+
+
+def packed_size(obj, ensure_determinism, unsafe_fallback, indexed=False, dedup=False, cache=None, version=1):
+    """
+    Exact size of the uncompressed blob of 'obj', e.g., to preallocate the buffer for 'pack_into()'.
+
+    The object is traversed, but its blob is not assembled: arrays are only referenced.
+    """
+    ctx = Packing(ensure_determinism, unsafe_fallback, chunked=True, indexed=indexed, dedup=dedup, cache=cache,
+                  version=version)
+    return _nbytes(_encode(obj, ctx))
+
+
+class _Into:
+    """File-like writer into a buffer, see 'pack_into()'."""
+
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, buf, offset):
+        if type(buf) is bytearray:
+            buf.extend(bytes(max(offset - len(buf), 0)))  # Zero padding up to 'offset', which slice assignment would not do.
+        else:
+            buf = memoryview(buf).cast("B")
+        self.buf, self.pos = buf, offset
+
+    def write(self, data):
+        n = len(data) if type(data) is bytes else memoryview(data).nbytes
+        end = self.pos + n
+        if end > len(self.buf) and type(self.buf) is not bytearray:
+            raise ValueError(f"Buffer too small: {len(self.buf)} bytes.")
+        self.buf[self.pos : end] = data if type(data) is bytes else memoryview(data).cast("B")
+        self.pos = end
+        return n
+
+
+def unpack_from(fileobj, chunksize=CHUNKSIZE):
+    """
+    Deserialize an object written by 'pack_to()' (or 'pack()') from the readable binary 'fileobj'.
+
+    The compressed input is never held entirely in memory, only the decompressed dump.
+    Reading stops at the end of the compressed stream, so that the next blob can be read from 'fileobj':
+    bytes read past it are given back when 'fileobj' is seekable, and only peeked at when it is buffered (e.g., a pipe
+    opened by 'open()'). Otherwise, they would be lost, and an exception is raised instead.
+    Uncompressed input is read until EOF.
+
+    >>> f = BytesIO()
+    >>> _ = pack_to(f, [1, b"x"], ensure_determinism=True, unsafe_fallback=False)
+    >>> _ = pack_to(f, (3, 4), ensure_determinism=True, unsafe_fallback=False)
+    >>> _ = f.seek(0)
+    >>> unpack_from(f, chunksize=8), unpack_from(f)
+    ([1, b'x'], (3, 4))
+    >>> import os
+    >>> def pipe(buffering):
+    ...     r, w = os.pipe()
+    ...     _ = os.write(w, f.getvalue())
+    ...     os.close(w)
+    ...     return open(r, "rb", buffering=buffering)
+    >>> with pipe(-1) as p:
+    ...     unpack_from(p), unpack_from(p)
+    ([1, b'x'], (3, 4))
+    >>> with pipe(0) as p:
+    ...     unpack_from(p)
+    Traceback (most recent call last):
+    ...
+    Exception: Read 76 bytes past the blob, which cannot be given back to a non-seekable stream without 'peek()'.
+    """
+    prefix = fileobj.read(7)
+    codec = codec_by_tag(prefix)
+    if codec is None:
+        return _decode(prefix + fileobj.read())
+
+    start, read = perf_counter(), 7
+    decompressor = codec.decompressor()
+    out = BytesIO()
+    seekable = fileobj.seekable()
+    peek = None if seekable else getattr(fileobj, "peek", None)
+    unused = b""
+    while not decompressor.eof:
+        data = fileobj.read(chunksize) if peek is None else peek(chunksize)[:chunksize]
+        if not data:
+            raise EOFError(f"Truncated {codec.name} stream.")
+        read += len(data)
+        out.write(decompressor.decompress(data))
+        unused = decompressor.unused_data or b""  # None with lz4.
+        if peek is not None:  # Consume only what the decompressor used.
+            fileobj.read(len(data) - len(unused))
+    if unused and peek is None:
+        if not seekable:
+            msg = "which cannot be given back to a non-seekable stream without 'peek()'."
+            raise Exception(f"Read {len(unused)} bytes past the blob, {msg}")
+        fileobj.seek(-len(unused), 1)
+    dump = out.getvalue()
+    if instrument.ACTIVE is not None:
+        read -= len(unused)
+        instrument.ACTIVE.record("decompress", codec.name, read, len(dump), perf_counter() - start)
+    return _decode(dump)